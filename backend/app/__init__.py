@@ -1,5 +1,6 @@
 from flask import Flask
 from .config import Config
+from .replicas import RoutingSession
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager
@@ -9,13 +10,14 @@ import stripe
 
 app = Flask(__name__)
 app.config.from_object(Config)
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
 migrate = Migrate(app, db)
 stripe.api_key = app.config['STRIPE_SECRET_KEY']
+stripe.api_base = app.config['STRIPE_API_BASE']
 
 
 login = LoginManager(app)
 login.login_view = 'login'
 
-from app import routes, models
+from app import database, metrics, routes, api, models, identity, outbox, payments, notifications, commands
 
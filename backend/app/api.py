@@ -0,0 +1,304 @@
+from operator import attrgetter
+from urllib.parse import urlsplit, parse_qsl
+from flask import request, jsonify, abort, current_app
+from flask_login import current_user
+from sqlalchemy.orm import joinedload, load_only
+from werkzeug.datastructures import MultiDict
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import Map, Rule
+from app import app
+from app.models import User, Gig, Message, Review, Booking
+from app.categories import get_categories, get_category
+from app.database import read_only
+from app.images import profile_image_url
+from app.search import find_gigs
+from app.pagination import keyset_paginate
+from app.response_cache import cached_response, gig_tag, ALL_GIGS
+
+
+API_PREFIX = '/api/v1'
+
+# Read endpoints by rule, so /batch can resolve paths without a new request
+_api_map = Map()
+_api_views = {}
+
+
+
+def _isoformat(value):
+    # Timestamps are stored as naive UTC
+    return value.isoformat() + 'Z' if value is not None else None
+
+
+
+def _local_isoformat(value):
+    # Wall-clock times entered on the booking form; their zone isn't stored
+    return value.isoformat() if value is not None else None
+
+
+
+class Field(object):
+    """How the API reads one attribute of a model.
+
+    columns are loaded from the model's table for it (everything not
+    requested is deferred) and load holds extra loader options, e.g. a
+    joinedload for a nested object.
+    """
+    def __init__(self, get, columns=(), load=()):
+        self.get = get
+        self.columns = columns
+        self.load = load
+
+
+
+def _column(column):
+    return Field(attrgetter(column.key), (column,))
+
+
+
+def _timestamp(column):
+    return Field(lambda obj: _isoformat(getattr(obj, column.key)), (column,))
+
+
+
+def _wall_clock(column):
+    return Field(lambda obj: _local_isoformat(getattr(obj, column.key)), (column,))
+
+
+
+def _user(relationship):
+    def get(obj):
+        user = getattr(obj, relationship.key)
+        return {'id': user.id, 'username': user.username, 'profile_image': profile_image_url(user.profile_image)}
+    return Field(get, (), (joinedload(relationship).load_only(User.username, User.profile_image),))
+
+
+
+class Resource(object):
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = fields
+
+    def requested(self, args):
+        """Field names asked for with ?fields=a,b (all of them by default)."""
+        if not args.get('fields'):
+            return list(self.fields)
+        names = [name.strip() for name in args['fields'].split(',') if name.strip()]
+        unknown = [name for name in names if name not in self.fields]
+        if unknown:
+            abort(400, f'Unknown fields: {", ".join(unknown)}')
+        return names
+
+    def options(self, names, *columns):
+        """Loader options that fetch just what the named fields (and columns) need."""
+        columns = [self.model.id, *columns]
+        options = []
+        for name in names:
+            columns.extend(self.fields[name].columns)
+            options.extend(self.fields[name].load)
+        return [load_only(*columns), *options]
+
+    def dump(self, obj, names):
+        return {name: self.fields[name].get(obj) for name in names}
+
+    def dump_page(self, page, names):
+        return {'items': [self.dump(obj, names) for obj in page], 'next_cursor': page.next_cursor}
+
+
+
+def _category(gig):
+    category = get_category(gig.category_id)
+    return {'id': gig.category_id, 'name': category.name if category else None}
+
+
+
+gigs = Resource(Gig, {
+    'id': Field(attrgetter('id')),
+    'title': _column(Gig.title),
+    'description': _column(Gig.description),
+    'price': _column(Gig.price),
+    'location': _column(Gig.location),
+    'travel_radius': _column(Gig.travel_radius),
+    'latitude': _column(Gig.latitude),
+    'longitude': _column(Gig.longitude),
+    'timestamp': _timestamp(Gig.timestamp),
+    'rating_count': _column(Gig.rating_count),
+    'average_rating': Field(attrgetter('average_rating'), (Gig.rating_count, Gig.rating_sum)),
+    # Names come from the category cache rather than a join
+    'category': Field(_category, (Gig.category_id,)),
+    'seller': _user(Gig.seller),
+})
+
+reviews = Resource(Review, {
+    'id': Field(attrgetter('id')),
+    'gig_id': _column(Review.gig_id),
+    'rating': _column(Review.rating),
+    'comment': _column(Review.comment),
+    'timestamp': _timestamp(Review.timestamp),
+    'user': _user(Review.user),
+})
+
+bookings = Resource(Booking, {
+    'id': Field(attrgetter('id')),
+    'status': _column(Booking.status),
+    'booking_date': _wall_clock(Booking.booking_date),
+    'duration': _column(Booking.duration),
+    'end_date': _wall_clock(Booking.end_date),
+    'timestamp': _timestamp(Booking.timestamp),
+    'gig': Field(lambda booking: {'id': booking.gig_id, 'title': booking.gig.title}, (Booking.gig_id,),
+                 (joinedload(Booking.gig).load_only(Gig.title, Gig.seller_id),)),
+    'buyer': _user(Booking.buyer),
+})
+
+messages = Resource(Message, {
+    'id': Field(attrgetter('id')),
+    'body': _column(Message.body),
+    'timestamp': _timestamp(Message.timestamp),
+    'sender': _user(Message.sender),
+})
+
+
+
+def _call(view, args, view_args):
+    try:
+        return 200, view(args, **view_args)
+    except HTTPException as e:
+        return e.code, {'error': e.description}
+
+
+
+def api_route(rule, login=False, cache_tags=None):
+    """Register a read-only JSON endpoint under API_PREFIX.
+
+    The decorated function takes the query args as its first argument and
+    returns the response body, so /batch can call it directly. cache_tags
+    is passed to cached_response for pages that are the same for every
+    anonymous visitor.
+    """
+    def decorator(fn):
+        endpoint = f'api_{fn.__name__}'
+
+        def resolve(args, **view_args):
+            if login and not current_user.is_authenticated:
+                abort(401, 'Login required.')
+            return fn(args, **view_args)
+
+        def view(**view_args):
+            status, body = _call(resolve, request.args, view_args)
+            return jsonify(body), status
+
+        if cache_tags is not None:
+            view = cached_response(cache_tags)(view)
+        _api_map.add(Rule(rule, endpoint=endpoint))
+        _api_views[endpoint] = resolve
+        app.add_url_rule(API_PREFIX + rule, endpoint, view)
+        return fn
+    return decorator
+
+
+
+@api_route('/categories')
+def categories(args):
+    return {'items': [category._asdict() for category in get_categories()]}
+
+
+
+@api_route('/gigs', cache_tags=lambda: [ALL_GIGS])
+def gig_list(args):
+    names = gigs.requested(args)
+    location = args.get('location', '')
+    radius = args.get('radius', type=int)
+    # The radius filter reads the coordinates of every candidate
+    query = Gig.query.options(*gigs.options(names, Gig.latitude, Gig.longitude))
+    page = find_gigs(query, args.get('keyword', ''), args.get('category_id', type=int),
+                     location, radius, args.get('cursor'))
+    if page is None:
+        abort(400, 'Could not geocode the provided location.')
+    return gigs.dump_page(page, names)
+
+
+
+@api_route('/gigs/<int:gig_id>', cache_tags=lambda gig_id: [gig_tag(gig_id)])
+def gig(args, gig_id):
+    names = gigs.requested(args)
+    return gigs.dump(Gig.query.options(*gigs.options(names)).get_or_404(gig_id), names)
+
+
+
+@api_route('/gigs/<int:gig_id>/reviews', cache_tags=lambda gig_id: [gig_tag(gig_id)])
+def gig_reviews(args, gig_id):
+    names = reviews.requested(args)
+    query = Review.query.filter_by(gig_id=gig_id).options(*reviews.options(names))
+    page = keyset_paginate(query, [(Review.timestamp, True), (Review.id, True)], args.get('cursor'))
+    return reviews.dump_page(page, names)
+
+
+
+@api_route('/bookings', login=True)
+def booking_list(args):
+    """Bookings the user made, or with ?role=seller, bookings of their gigs."""
+    names = bookings.requested(args)
+    if args.get('role', 'buyer') == 'seller':
+        query = Booking.query.filter_by(seller_id=current_user.id)
+    else:
+        query = Booking.query.filter_by(buyer_id=current_user.id)
+    query = query.options(*bookings.options(names))
+    page = keyset_paginate(query, [(Booking.timestamp, True), (Booking.id, True)], args.get('cursor'))
+    return bookings.dump_page(page, names)
+
+
+
+@api_route('/bookings/<int:booking_id>', login=True)
+def booking(args, booking_id):
+    names = bookings.requested(args)
+    query = Booking.query.options(*bookings.options(names, Booking.buyer_id, Booking.gig_id))
+    booking = query.get_or_404(booking_id)
+    if booking.buyer_id != current_user.id and booking.gig.seller_id != current_user.id:
+        abort(403, 'You are not authorized to view this booking.')
+    return bookings.dump(booking, names)
+
+
+
+@api_route('/messages', login=True)
+def message_list(args):
+    names = messages.requested(args)
+    query = current_user.received_messages.options(*messages.options(names))
+    page = keyset_paginate(query, [(Message.timestamp, True), (Message.id, True)], args.get('cursor'))
+    return messages.dump_page(page, names)
+
+
+
+def _dispatch(adapter, path):
+    url = urlsplit(path)
+    path = url.path
+    if path.startswith(API_PREFIX + '/'):
+        path = path[len(API_PREFIX):]
+    try:
+        endpoint, view_args = adapter.match(path, method='GET')
+    except HTTPException as e:
+        return e.code, {'error': e.description}
+    args = MultiDict(parse_qsl(url.query, keep_blank_values=True))
+    return _call(_api_views[endpoint], args, view_args)
+
+
+
+@app.route(API_PREFIX + '/batch', methods=['POST'])
+@read_only
+def api_batch():
+    """Resolve several API reads in one round trip.
+
+    Takes {"requests": ["/gigs/1?fields=title", "/categories", ...]} and
+    returns {"responses": [{"status": 200, "body": {...}}, ...]} in order.
+    """
+    payload = request.get_json(silent=True)
+    paths = payload.get('requests') if isinstance(payload, dict) else None
+    if not isinstance(paths, list) or not all(isinstance(path, str) for path in paths):
+        return jsonify(error='Expected a JSON body like {"requests": ["/gigs/1"]}.'), 400
+    if len(paths) > current_app.config['API_BATCH_LIMIT']:
+        return jsonify(error=f'At most {current_app.config["API_BATCH_LIMIT"]} requests per batch.'), 400
+
+    adapter = _api_map.bind('')
+    responses = []
+    for path in paths:
+        status, body = _dispatch(adapter, path)
+        responses.append({'status': status, 'body': body})
+    return jsonify(responses=responses)
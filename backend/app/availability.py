@@ -0,0 +1,121 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import update
+from app import db
+from app.models import User, Booking
+from app.seller_stats import record_booking
+
+
+# Bookings in any other status (Declined) don't take up the seller's time
+ACTIVE_STATUSES = ('Pending', 'Accepted', 'Confirmed', 'Completed')
+
+DURATIONS = [(30, '30 minutes'), (60, '1 hour'), (90, '1.5 hours'), (120, '2 hours'),
+             (180, '3 hours'), (240, '4 hours'), (480, '8 hours')]
+# Bounds the index scan for bookings that started earlier but still overlap
+MAX_DURATION = timedelta(minutes=max(minutes for minutes, label in DURATIONS))
+
+
+
+class SlotTaken(Exception):
+    pass
+
+
+
+def _overlapping(seller_id, start, end):
+    # ix_booking_seller_id_booking_date makes this a range scan over the
+    # bookings starting in (start - MAX_DURATION, end) instead of the seller's
+    # whole history; end_date then drops those that finish before start.
+    return Booking.query \
+        .filter(Booking.seller_id == seller_id,
+                Booking.booking_date > start - MAX_DURATION,
+                Booking.booking_date < end,
+                Booking.end_date > start,
+                Booking.status.in_(ACTIVE_STATUSES))
+
+
+
+def busy_intervals(seller_id, start, end):
+    """(start, end) of the seller's active bookings that overlap [start, end), merged and sorted."""
+    rows = _overlapping(seller_id, start, end) \
+        .with_entities(Booking.booking_date, Booking.end_date) \
+        .order_by(Booking.booking_date) \
+        .all()
+    merged = []
+    for booking_start, booking_end in rows:
+        # Bookings from before conflicts were checked may overlap each other
+        if merged and booking_start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], booking_end))
+        else:
+            merged.append((booking_start, booking_end))
+    return merged
+
+
+
+def is_free(seller_id, start, end):
+    return _overlapping(seller_id, start, end).first() is None
+
+
+
+def free_slots(seller_id, first_day, days, duration, now=None):
+    """Start times on each day when a booking of duration minutes would fit.
+
+    Slots start every AVAILABILITY_SLOT_MINUTES between AVAILABILITY_DAY_START
+    and AVAILABILITY_DAY_END. Returns [(date, [datetime, ...]), ...].
+    """
+    config = current_app.config
+    # booking_date is the wall-clock time entered on the form, not UTC
+    now = now or datetime.now()
+    step = timedelta(minutes=config['AVAILABILITY_SLOT_MINUTES'])
+    length = timedelta(minutes=duration)
+    first = datetime.combine(first_day, datetime.min.time())
+    busy = busy_intervals(seller_id, first, first + timedelta(days=days))
+
+    result = []
+    index = 0
+    for offset in range(days):
+        day = first + timedelta(days=offset)
+        slot = day + timedelta(hours=config['AVAILABILITY_DAY_START'])
+        closing = day + timedelta(hours=config['AVAILABILITY_DAY_END'])
+        slots = []
+        # Slots and busy intervals are both in order, so one pass over each
+        while slot + length <= closing:
+            while index < len(busy) and busy[index][1] <= slot:
+                index += 1
+            if index < len(busy) and busy[index][0] < slot + length:
+                slot = max(slot + step, day + step * -(-(busy[index][1] - day) // step))
+                continue
+            if slot >= now:
+                slots.append(slot)
+            slot += step
+        result.append((day.date(), slots))
+    return result
+
+
+
+def lock_calendar(seller_id):
+    """Serialize booking changes for one seller until the transaction ends.
+
+    The row lock (Postgres) or write lock (SQLite) taken by this UPDATE is held
+    until commit, so a concurrent booking waits and then sees this one.
+    """
+    db.session.execute(
+        update(User)
+        .where(User.id == seller_id)
+        .values(calendar_version=User.calendar_version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+
+def book(gig, buyer, start, duration):
+    """Add a pending booking of gig, or raise SlotTaken if the seller is busy then."""
+    end = start + timedelta(minutes=duration)
+    lock_calendar(gig.seller_id)
+    if not is_free(gig.seller_id, start, end):
+        db.session.rollback()
+        raise SlotTaken()
+    booking = Booking(gig=gig, buyer=buyer, seller_id=gig.seller_id, booking_date=start,
+                      duration=duration, end_date=end, status='Pending')
+    db.session.add(booking)
+    record_booking(booking)
+    return booking
@@ -0,0 +1,56 @@
+import threading
+from collections import namedtuple
+from app.database import use_primary
+from app.models import Category
+from app.versions import get_version, bump_version
+
+
+VERSION_NAME = 'categories'
+
+CachedCategory = namedtuple('CachedCategory', ['id', 'name'])
+
+_lock = threading.Lock()
+_cached = (object(), [])
+
+
+
+def get_categories():
+    """All categories ordered by name, as plain (id, name) tuples.
+
+    Kept in memory until another process (or this one) calls
+    invalidate_categories().
+    """
+    global _cached
+    version = get_version(VERSION_NAME)
+    cached_version, categories = _cached
+    if cached_version == version:
+        return categories
+    with _lock:
+        use_primary()
+        categories = [
+            CachedCategory(id, name)
+            for id, name in Category.query.with_entities(Category.id, Category.name).order_by(Category.name)
+        ]
+        _cached = (version, categories)
+    return categories
+
+
+
+def get_category(category_id):
+    for category in get_categories():
+        if category.id == category_id:
+            return category
+    return None
+
+
+
+def get_category_by_name(name):
+    for category in get_categories():
+        if category.name == name:
+            return category
+    return None
+
+
+
+def invalidate_categories():
+    bump_version(VERSION_NAME)
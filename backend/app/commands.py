@@ -0,0 +1,165 @@
+import json
+import sqlite3
+import time
+import click
+from datetime import datetime
+from sqlalchemy import func
+from app import app, db
+from app.models import Gig, Review, OutboxEmail
+from app.outbox import run_worker
+from app import payments
+from app.search import rebuild_search_index
+from app.seller_stats import rebuild_seller_stats
+from app.importer import GigImporter, read_rows
+
+
+
+@app.cli.command('rebuild-search-index')
+def rebuild_search_index_command():
+    """Create the gig full-text index if needed and rebuild it from the gig table."""
+    rebuild_search_index()
+    click.echo('Search index rebuilt.')
+
+
+
+@app.cli.command('check-ratings')
+@click.option('--fix', is_flag=True, help='Rewrite mismatched aggregates from the review table.')
+def check_ratings_command(fix):
+    """Compare Gig.rating_count/rating_sum with the review table."""
+    totals = db.session.query(
+        Review.gig_id,
+        func.count(Review.id).label('count'),
+        func.sum(Review.rating).label('sum')
+    ).group_by(Review.gig_id).subquery()
+    actual_count = func.coalesce(totals.c.count, 0)
+    actual_sum = func.coalesce(totals.c.sum, 0)
+    mismatches = db.session.query(Gig, actual_count, actual_sum) \
+        .outerjoin(totals, totals.c.gig_id == Gig.id) \
+        .filter((Gig.rating_count != actual_count) | (Gig.rating_sum != actual_sum)) \
+        .all()
+
+    for gig, count, total in mismatches:
+        click.echo(f'Gig {gig.id}: stored {gig.rating_count}/{gig.rating_sum}, actual {count}/{total}')
+        if fix:
+            gig.rating_count = count
+            gig.rating_sum = total
+    if fix:
+        db.session.commit()
+
+    if not mismatches:
+        click.echo('All rating aggregates are consistent.')
+    elif fix:
+        click.echo(f'Fixed {len(mismatches)} gig(s).')
+    else:
+        raise SystemExit(1)
+
+
+
+@app.cli.command('send-emails')
+@click.option('--once', is_flag=True, help='Exit once the outbox has no more due emails.')
+def send_emails_command(once):
+    """Deliver queued emails from the outbox."""
+    run_worker(once=once)
+
+
+
+@app.cli.command('process-stripe-events')
+@click.option('--once', is_flag=True, help='Exit once no more webhook events are due.')
+def process_stripe_events_command(once):
+    """Apply queued Stripe webhook events to bookings."""
+    payments.run_worker(once=once)
+
+
+
+@app.cli.command('requeue-dead-emails')
+def requeue_dead_emails_command():
+    """Move dead-lettered outbox emails back to pending."""
+    count = OutboxEmail.query.filter_by(status='Dead').update({
+        'status': 'Pending',
+        'attempts': 0,
+        'next_attempt_at': datetime.utcnow(),
+    })
+    db.session.commit()
+    click.echo(f'Requeued {count} email(s).')
+
+
+
+@app.cli.command('import-gigs')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']),
+              help='Input format (default: guessed from the extension).')
+@click.option('--seller', help='Username to use for rows without a seller column.')
+@click.option('--batch-size', default=1000, show_default=True, help='Gigs per insert and commit.')
+@click.option('--workers', default=8, show_default=True, help='Concurrent geocoding requests.')
+@click.option('--create-categories', is_flag=True, help='Create categories that don\'t exist yet.')
+@click.option('--errors', 'errors_path', type=click.Path(dir_okay=False, writable=True),
+              help='Write rejected rows here as JSON Lines, ready to fix and import again.')
+def import_gigs_command(path, file_format, seller, batch_size, workers, create_categories, errors_path):
+    """Bulk-import gigs from a CSV or JSON Lines file.
+
+    Columns: title, description, price, location, travel_radius, category
+    (by name), seller (username) and optionally latitude and longitude,
+    which skip geocoding.
+    """
+    errors_file = open(errors_path, 'w') if errors_path else None
+    shown = 0
+
+    def report(line_number, row, error):
+        nonlocal shown
+        if shown < 20:
+            click.echo(f'Line {line_number}: {error}', err=True)
+            shown += 1
+        if errors_file:
+            errors_file.write(json.dumps(dict(row, _line=line_number, _error=error)) + '\n')
+
+    started = time.monotonic()
+
+    def progress(importer):
+        elapsed = time.monotonic() - started
+        click.echo(f'{importer.imported} imported, {importer.failed} failed '
+                   f'({importer.imported / elapsed:.0f} gigs/s)')
+
+    importer = GigImporter(batch_size, workers, seller, create_categories, report)
+    try:
+        imported, failed = importer.run(read_rows(path, file_format), progress)
+    finally:
+        if errors_file:
+            errors_file.close()
+    click.echo(f'Done in {time.monotonic() - started:.1f}s: {imported} imported, {failed} failed.')
+    if failed:
+        raise SystemExit(1)
+
+
+
+@app.cli.command('sync-replicas')
+def sync_replicas_command():
+    """Copy a SQLite primary into SQLite replica files, for trying out replica routing.
+
+    Real replicas (Postgres streaming replication, for example) keep themselves
+    up to date and don't need this.
+    """
+    primary = db.engine
+    if primary.url.get_backend_name() != 'sqlite':
+        raise click.ClickException('Only a SQLite primary can be copied.')
+    source = sqlite3.connect(primary.url.database)
+    try:
+        for key in sorted(app.config['SQLALCHEMY_BINDS']):
+            url = db.engines[key].url
+            if not key.startswith('replica_') or url.get_backend_name() != 'sqlite':
+                continue
+            target = sqlite3.connect(url.database)
+            try:
+                source.backup(target)
+            finally:
+                target.close()
+            click.echo(f'Copied to {url.database}.')
+    finally:
+        source.close()
+
+
+
+@app.cli.command('rebuild-seller-stats')
+def rebuild_seller_stats_command():
+    """Recompute the seller dashboard counters from the booking and review tables."""
+    rows = rebuild_seller_stats()
+    click.echo(f'Rebuilt {rows} seller stats row(s).')
@@ -8,13 +8,98 @@ class Config(object):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Comma-separated read replica URLs. GET requests read from a random one,
+    # unless the user wrote something in the last REPLICA_STICKY_SECONDS.
+    DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+    SQLALCHEMY_BINDS = {f'replica_{i}': url for i, url in enumerate(DATABASE_REPLICA_URLS)}
+    REPLICA_STICKY_SECONDS = float(os.environ.get('REPLICA_STICKY_SECONDS', 10))
+
+    # WAL journaling and connection pragmas for running SQLite under several
+    # workers (see app/database.py)
+    SQLITE_PRODUCTION_MODE = os.environ.get('SQLITE_PRODUCTION_MODE', '0') == '1'
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+    # Goes into the PRAGMA text as is, so only SQLite's own levels are allowed
+    if SQLITE_SYNCHRONOUS not in ('OFF', 'NORMAL', 'FULL', 'EXTRA'):
+        raise ValueError(f'SQLITE_SYNCHRONOUS must be OFF, NORMAL, FULL or EXTRA, not {SQLITE_SYNCHRONOUS!r}')
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))  # milliseconds
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', -64000))  # negative: KiB
+
+    ITEMS_PER_PAGE = int(os.environ.get('ITEMS_PER_PAGE', 20))
+    # Bookable hours offered by the availability endpoint
+    AVAILABILITY_DAY_START = int(os.environ.get('AVAILABILITY_DAY_START', 8))
+    AVAILABILITY_DAY_END = int(os.environ.get('AVAILABILITY_DAY_END', 22))
+    AVAILABILITY_SLOT_MINUTES = int(os.environ.get('AVAILABILITY_SLOT_MINUTES', 30))
+    AVAILABILITY_MAX_DAYS = int(os.environ.get('AVAILABILITY_MAX_DAYS', 31))
+    DASHBOARD_DAYS = int(os.environ.get('DASHBOARD_DAYS', 30))
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 8 * 1024 * 1024))
+    API_BATCH_LIMIT = int(os.environ.get('API_BATCH_LIMIT', 20))
+
+    # Shared across worker processes on one host to invalidate in-process caches
+    CACHE_VERSION_DIR = os.environ.get('CACHE_VERSION_DIR') or os.path.join(basedir, '..', 'instance', 'cache_versions')
+    RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 500))
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 60))
+    # Signed-in users' basic fields, so loading current_user needs no query
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 10000))
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 300))
+
+    PROFILE_IMAGE_SIZES = (64, 125, 250)
+    PROFILE_IMAGE_MAX_BYTES = int(os.environ.get('PROFILE_IMAGE_MAX_BYTES', 5 * 1024 * 1024))
+    PROFILE_IMAGE_MAX_PIXELS = int(os.environ.get('PROFILE_IMAGE_MAX_PIXELS', 25000000))
+    PROFILE_IMAGE_WORKERS = int(os.environ.get('PROFILE_IMAGE_WORKERS', 2))
+    LAST_SEEN_FLUSH_INTERVAL = float(os.environ.get('LAST_SEEN_FLUSH_INTERVAL', 30))
+    LAST_SEEN_GRANULARITY = int(os.environ.get('LAST_SEEN_GRANULARITY', 60))
+
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    # Log requests slower than this many seconds with their top queries (0 disables)
+    SLOW_REQUEST_THRESHOLD = float(os.environ.get('SLOW_REQUEST_THRESHOLD', 0))
+    SLOW_REQUEST_TOP_QUERIES = int(os.environ.get('SLOW_REQUEST_TOP_QUERIES', 5))
     
     STRIPE_PUBLIC_KEY = os.environ.get('STRIPE_PUBLIC_KEY')
     STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY')
+    STRIPE_API_BASE = os.environ.get('STRIPE_API_BASE', 'https://api.stripe.com')
+    STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET')
+    # Webhook events are stored and applied by a background worker
+    STRIPE_EVENTS_IN_PROCESS = os.environ.get('STRIPE_EVENTS_IN_PROCESS', '1') == '1'
+    STRIPE_EVENTS_POLL_INTERVAL = float(os.environ.get('STRIPE_EVENTS_POLL_INTERVAL', 5))
+    STRIPE_EVENTS_MAX_ATTEMPTS = int(os.environ.get('STRIPE_EVENTS_MAX_ATTEMPTS', 10))
+    STRIPE_EVENTS_BACKOFF = float(os.environ.get('STRIPE_EVENTS_BACKOFF', 30))
+    STRIPE_EVENTS_LEASE = int(os.environ.get('STRIPE_EVENTS_LEASE', 60))
+
+    # Server-Sent Events. 'memory' only reaches streams in the same process;
+    # use 'database' when running several worker processes.
+    NOTIFICATION_BACKEND = os.environ.get('NOTIFICATION_BACKEND', 'memory')
+    NOTIFICATION_POLL_INTERVAL = float(os.environ.get('NOTIFICATION_POLL_INTERVAL', 1))
+    NOTIFICATION_RETENTION = int(os.environ.get('NOTIFICATION_RETENTION', 300))
+    NOTIFICATION_HEARTBEAT = float(os.environ.get('NOTIFICATION_HEARTBEAT', 15))
+    NOTIFICATION_STREAM_DURATION = float(os.environ.get('NOTIFICATION_STREAM_DURATION', 300))
+
+    # Shared settings for calls to Google Maps, Mailgun and Stripe
+    OUTBOUND_CONNECT_TIMEOUT = float(os.environ.get('OUTBOUND_CONNECT_TIMEOUT', 3))
+    OUTBOUND_READ_TIMEOUT = float(os.environ.get('OUTBOUND_READ_TIMEOUT', 10))
+    OUTBOUND_RETRIES = int(os.environ.get('OUTBOUND_RETRIES', 2))
+    OUTBOUND_RETRY_BUDGET = float(os.environ.get('OUTBOUND_RETRY_BUDGET', 0.2))
+    OUTBOUND_POOL_SIZE = int(os.environ.get('OUTBOUND_POOL_SIZE', 10))
+    OUTBOUND_BREAKER_THRESHOLD = int(os.environ.get('OUTBOUND_BREAKER_THRESHOLD', 5))
+    OUTBOUND_BREAKER_COOLDOWN = float(os.environ.get('OUTBOUND_BREAKER_COOLDOWN', 30))
 
     GOOGLE_MAPS_API_KEY = os.environ.get('GOOGLE_MAPS_API_KEY')
+    GEOCODE_URL = os.environ.get('GEOCODE_URL', 'https://maps.googleapis.com/maps/api/geocode/json')
+    GEOCODE_CACHE_SIZE = int(os.environ.get('GEOCODE_CACHE_SIZE', 1024))
+    GEOCODE_CACHE_TTL = int(os.environ.get('GEOCODE_CACHE_TTL', 30 * 24 * 3600))
+    GEOCODE_NEGATIVE_TTL = int(os.environ.get('GEOCODE_NEGATIVE_TTL', 3600))
     
     MAILGUN_API_KEY = os.environ.get('MAILGUN_API_KEY')
     MAILGUN_DOMAIN = os.environ.get('MAILGUN_DOMAIN')
     MAILGUN_BASE_URL = os.environ.get('MAILGUN_BASE_URL', 'https://api.mailgun.net/v3')
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER', 'Your Name <no-reply@yourdomain.com>')
+
+    # Outgoing email is written to the outbox table and delivered by a worker
+    EMAIL_OUTBOX_IN_PROCESS = os.environ.get('EMAIL_OUTBOX_IN_PROCESS', '1') == '1'
+    EMAIL_OUTBOX_WORKERS = int(os.environ.get('EMAIL_OUTBOX_WORKERS', 4))
+    EMAIL_OUTBOX_BATCH_SIZE = int(os.environ.get('EMAIL_OUTBOX_BATCH_SIZE', 50))
+    EMAIL_OUTBOX_POLL_INTERVAL = float(os.environ.get('EMAIL_OUTBOX_POLL_INTERVAL', 5))
+    EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('EMAIL_OUTBOX_MAX_ATTEMPTS', 8))
+    EMAIL_OUTBOX_BACKOFF = float(os.environ.get('EMAIL_OUTBOX_BACKOFF', 30))
+    EMAIL_OUTBOX_LEASE = int(os.environ.get('EMAIL_OUTBOX_LEASE', 300))
@@ -0,0 +1,73 @@
+import random
+import sqlite3
+import time
+from flask import request, session
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app import app, db
+
+
+_read_only_views = set()
+
+
+
+@event.listens_for(Engine, 'connect')
+def configure_sqlite(dbapi_connection, connection_record):
+    """Apply the SQLITE_* settings to every new pooled SQLite connection.
+
+    WAL lets readers run while a write is in progress, and busy_timeout
+    makes a writer wait for the lock instead of failing with "database is
+    locked". synchronous=NORMAL is safe under WAL: a power cut can lose the
+    last commits but never corrupts the database.
+    """
+    if not isinstance(dbapi_connection, sqlite3.Connection) or not app.config['SQLITE_PRODUCTION_MODE']:
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute(f'PRAGMA synchronous={app.config["SQLITE_SYNCHRONOUS"]}')
+        cursor.execute(f'PRAGMA busy_timeout={int(app.config["SQLITE_BUSY_TIMEOUT"])}')
+        cursor.execute(f'PRAGMA mmap_size={int(app.config["SQLITE_MMAP_SIZE"])}')
+        cursor.execute(f'PRAGMA cache_size={int(app.config["SQLITE_CACHE_SIZE"])}')
+        cursor.execute('PRAGMA temp_store=MEMORY')
+    finally:
+        cursor.close()
+
+
+
+def read_only(view):
+    """Let a view that never writes read from a replica even for POSTs."""
+    _read_only_views.add(view)
+    return view
+
+
+
+def use_primary():
+    """Read from the primary for the rest of this request.
+
+    For results that outlive the request (shared caches), which must not be
+    filled from a replica that hasn't caught up yet.
+    """
+    db.session.info.pop('replica', None)
+
+
+
+@app.before_request
+def choose_replica():
+    replicas = [key for key in app.config['SQLALCHEMY_BINDS'] if key.startswith('replica_')]
+    if not replicas:
+        return
+    if request.method not in ('GET', 'HEAD') and app.view_functions.get(request.endpoint) not in _read_only_views:
+        return
+    # Users read their own writes: they stay on the primary for a while after one
+    if session.get('primary_until', 0) > time.time():
+        return
+    db.session.info['replica'] = db.engines[random.choice(replicas)]
+
+
+
+@app.after_request
+def stick_to_primary(response):
+    if app.config['DATABASE_REPLICA_URLS'] and db.session.info.get('wrote'):
+        session['primary_until'] = time.time() + app.config['REPLICA_STICKY_SECONDS']
+    return response
@@ -1,5 +1,35 @@
 import requests
 from flask import current_app
+from app import db
+from app.models import OutboxEmail
+from app.outbound import get_upstream
+
+
+
+class EmailDeliveryError(Exception):
+    def __init__(self, message, permanent=False):
+        super().__init__(message)
+        self.permanent = permanent
+
+
+
+def mailgun_configured():
+    return bool(current_app.config['MAILGUN_API_KEY'] and current_app.config['MAILGUN_DOMAIN'])
+
+
+
+def queue_email(to_email, subject, html_content):
+    """Add an email to the outbox in the current transaction.
+
+    Nothing is sent until the caller commits; the outbox worker delivers it
+    afterwards, so a slow or failing Mailgun never holds up the request.
+    """
+    email = OutboxEmail(to_email=to_email, subject=subject, html_content=html_content)
+    db.session.add(email)
+    db.session.info['outbox_queued'] = True
+    return email
+
+
 
 def send_email(to_email, subject, html_content):
     api_key = current_app.config['MAILGUN_API_KEY']
@@ -8,11 +38,10 @@ def send_email(to_email, subject, html_content):
     base_url = current_app.config['MAILGUN_BASE_URL']
 
     if not api_key or not domain:
-        print('Mailgun API key or domain not configured.')
-        return
+        raise EmailDeliveryError('Mailgun API key or domain not configured.')
 
     try:
-        response = requests.post(
+        response = get_upstream('mailgun').post(
             f"{base_url}/{domain}/messages",
             auth=("api", api_key),
             data={
@@ -23,7 +52,10 @@ def send_email(to_email, subject, html_content):
             }
         )
         response.raise_for_status()
+    except requests.exceptions.HTTPError as e:
+        # 4xx other than rate limiting won't succeed on retry
+        status = e.response.status_code
+        raise EmailDeliveryError(f'Error sending email: {e}', permanent=400 <= status < 500 and status != 429)
     except requests.exceptions.RequestException as e:
-        current_app.logger.error(f'Error sending email: {e}')
-        return False
+        raise EmailDeliveryError(f'Error sending email: {e}')
     return True
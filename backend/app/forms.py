@@ -1,8 +1,10 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SubmitField, BooleanField, TextAreaField, IntegerField
+from wtforms import StringField, PasswordField, SubmitField, BooleanField, TextAreaField, IntegerField, SelectField
 from wtforms.validators import DataRequired, Email, EqualTo, ValidationError, Length, NumberRange, Optional
 from wtforms_sqlalchemy.fields import QuerySelectField
-from app.models import User, Category
+from app.models import User
+from app.categories import get_categories
+from app.availability import DURATIONS
 from wtforms.fields import DateTimeLocalField
 from flask_wtf.file import FileField, FileAllowed
 
@@ -43,7 +45,7 @@ class EditProfileForm(FlaskForm):
 
 
 def category_query():
-    return Category.query
+    return get_categories()
 
 
 
@@ -62,6 +64,7 @@ class GigForm(FlaskForm):
     category = QuerySelectField(
         'Category',
         query_factory=category_query,
+        get_pk=lambda category: category.id,
         get_label='name',
         allow_blank=False
     )
@@ -82,13 +85,14 @@ class MessageForm(FlaskForm):
 
 class BookingForm(FlaskForm):
     booking_date = DateTimeLocalField('Booking Date and Time', format='%Y-%m-%dT%H:%M', validators=[DataRequired()])
+    duration = SelectField('Duration', coerce=int, choices=DURATIONS, default=60)
     submit = SubmitField('Book Now')
 
 
 
 class SearchForm(FlaskForm):
     keyword = StringField('Keyword')
-    category = QuerySelectField('Category', query_factory=category_query, get_label='name', allow_blank=True)
+    category = QuerySelectField('Category', query_factory=category_query, get_pk=lambda category: category.id, get_label='name', allow_blank=True)
     location = StringField('Location')
     radius = IntegerField('Radius (km)', validators=[Optional()])
     submit = SubmitField('Search')
@@ -0,0 +1,77 @@
+from math import radians, degrees, cos, sin, asin, sqrt, pi
+from app.models import Gig
+
+
+EARTH_RADIUS_KM = 6371
+
+
+
+def haversine(lon1, lat1, lon2, lat2):
+    # Calculate the great circle distance between two points
+    # on the earth (specified in decimal degrees)
+    # Convert decimal degrees to radians
+    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
+    # Haversine formula
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = sin(dlat / 2)**2 + cos(lat1) * cos(lat2) * sin(dlon / 2)**2
+    c = 2 * asin(sqrt(a))
+    km = EARTH_RADIUS_KM * c  # Radius of earth in kilometers
+    return km
+
+
+
+def bounding_box(lat, lon, radius_km):
+    # Smallest lat/lng box that contains every point within radius_km of
+    # (lat, lon). Returns (min_lat, max_lat, lon_ranges) where lon_ranges is
+    # one (min_lon, max_lon) pair, or two when the box crosses the antimeridian.
+    delta_lat = degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat = lat - delta_lat
+    max_lat = lat + delta_lat
+
+    # Near a pole the circle wraps all meridians
+    if min_lat <= -90 or max_lat >= 90:
+        return max(min_lat, -90), min(max_lat, 90), [(-180, 180)]
+
+    delta_lon = degrees(asin(min(1, sin(radians(delta_lat)) / cos(radians(lat)))))
+    min_lon = lon - delta_lon
+    max_lon = lon + delta_lon
+    if min_lon < -180:
+        return min_lat, max_lat, [(min_lon + 360, 180), (-180, max_lon)]
+    if max_lon > 180:
+        return min_lat, max_lat, [(min_lon, 180), (-180, max_lon - 360)]
+    return min_lat, max_lat, [(min_lon, max_lon)]
+
+
+
+def within_bounding_box(query, lat, lon, radius_km):
+    # Cheap prefilter evaluated by the database on the (latitude, longitude)
+    # index. Everything it returns still needs the exact distance check.
+    min_lat, max_lat, lon_ranges = bounding_box(lat, lon, radius_km)
+    lon_clauses = [Gig.longitude.between(lo, hi) for lo, hi in lon_ranges]
+    query = query.filter(Gig.latitude.between(min_lat, max_lat))
+    if len(lon_clauses) == 1:
+        return query.filter(lon_clauses[0])
+    return query.filter(lon_clauses[0] | lon_clauses[1])
+
+
+
+def gigs_within_radius(gigs, lat, lon, radius_km):
+    # Exact great-circle check on the rows that survived the bounding box.
+    # The trig for the search point is hoisted out of the loop.
+    lat1 = radians(lat)
+    lon1 = radians(lon)
+    cos_lat1 = cos(lat1)
+    # Compare haversine terms instead of distances to skip asin/sqrt per row
+    max_a = sin(min(radius_km / EARTH_RADIUS_KM, pi) / 2)**2
+    nearby = []
+    for gig in gigs:
+        if gig.latitude is None or gig.longitude is None:
+            continue
+        lat2 = radians(gig.latitude)
+        dlat = lat2 - lat1
+        dlon = radians(gig.longitude) - lon1
+        a = sin(dlat / 2)**2 + cos_lat1 * cos(lat2) * sin(dlon / 2)**2
+        if a <= max_a:
+            nearby.append(gig)
+    return nearby
@@ -0,0 +1,117 @@
+import re
+from datetime import datetime, timedelta
+import requests
+from flask import current_app
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+from app import db
+from app.models import GeocodeCache
+from app.outbound import get_upstream
+from app.lru import LRUCache
+
+
+# Statuses that say the address itself is bad, so it is safe to remember them.
+# Anything else (quota, denied, network errors) is transient and never cached.
+NEGATIVE_STATUSES = ('ZERO_RESULTS', 'INVALID_REQUEST')
+
+
+
+_memory_cache = None
+
+
+
+def _get_memory_cache():
+    global _memory_cache
+    if _memory_cache is None:
+        _memory_cache = LRUCache(current_app.config['GEOCODE_CACHE_SIZE'])
+    return _memory_cache
+
+
+
+def normalize_address(address):
+    # "  New York,NY " and "new york, ny" should share a cache entry
+    address = address.strip().lower()
+    address = re.sub(r'\s*,\s*', ', ', address)
+    address = re.sub(r'\s+', ' ', address)
+    return address.strip(' ,.')[:255]
+
+
+
+def _lookup(address):
+    response = get_upstream('geocode').get(current_app.config['GEOCODE_URL'], params={
+        'address': address,
+        'key': current_app.config['GOOGLE_MAPS_API_KEY'],
+    })
+    data = response.json()
+    if data['status'] == 'OK':
+        location = data['results'][0]['geometry']['location']
+        return 'OK', location['lat'], location['lng']
+    return data['status'], None, None
+
+
+
+def _store(key, status, latitude, longitude):
+    if status == 'OK':
+        ttl = current_app.config['GEOCODE_CACHE_TTL']
+    else:
+        ttl = current_app.config['GEOCODE_NEGATIVE_TTL']
+    expires_at = datetime.utcnow() + timedelta(seconds=ttl)
+    _get_memory_cache().set(key, (status, latitude, longitude), ttl)
+
+    # A session of its own: the caller's pending changes are left for the
+    # caller to commit, and the entry is kept even if the caller rolls back
+    with Session(db.engine) as session:
+        entry = session.query(GeocodeCache).filter_by(address_key=key).first()
+        if entry is None:
+            entry = GeocodeCache(address_key=key)
+            session.add(entry)
+        entry.status = status
+        entry.latitude = latitude
+        entry.longitude = longitude
+        entry.timestamp = datetime.utcnow()
+        entry.expires_at = expires_at
+        try:
+            session.commit()
+        except IntegrityError:
+            # Another worker cached the same address first
+            session.rollback()
+        except OperationalError as e:
+            # The caller holds SQLite's write lock; the memory cache still has it
+            session.rollback()
+            current_app.logger.warning(f'Could not store geocode result for {key!r}: {e}')
+
+
+
+def geocode(address):
+    """Return (latitude, longitude) for an address, or None if it can't be geocoded."""
+    key = normalize_address(address)
+    if not key:
+        return None
+
+    entry = _get_memory_cache().get(key)
+    if entry is None:
+        # Without flushing the caller's pending changes, which would take the
+        # write lock on SQLite before _store needs it
+        with db.session.no_autoflush:
+            row = GeocodeCache.query.filter_by(address_key=key).first()
+        now = datetime.utcnow()
+        if row is not None and row.expires_at > now:
+            entry = (row.status, row.latitude, row.longitude)
+            _get_memory_cache().set(key, entry, (row.expires_at - now).total_seconds())
+
+    if entry is None:
+        try:
+            status, latitude, longitude = _lookup(address)
+        except (requests.exceptions.RequestException, ValueError, KeyError, IndexError) as e:
+            current_app.logger.error(f'Error geocoding {address!r}: {e}')
+            return None
+        if status != 'OK' and status not in NEGATIVE_STATUSES:
+            current_app.logger.warning(f'Geocoding {address!r} failed with {status}')
+            return None
+        _store(key, status, latitude, longitude)
+    else:
+        status, latitude, longitude = entry
+
+    if status != 'OK':
+        return None
+    return latitude, longitude
@@ -0,0 +1,91 @@
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import make_transient_to_detached
+from app import app, db, login
+from app.database import use_primary
+from app.lru import LRUCache
+from app.models import User
+from app.versions import get_version, bump_version
+
+
+# What views read from current_user. Anything else is loaded on first access.
+CACHED_FIELDS = ('id', 'username', 'email', 'about_me', 'profile_image')
+
+_cache = None
+
+
+
+def user_tag(user_id):
+    return f'user:{user_id}'
+
+
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        _cache = LRUCache(app.config['USER_CACHE_SIZE'])
+    return _cache
+
+
+
+def get_user(user_id):
+    """Load a user for Flask-Login without a query while its cached fields are fresh.
+
+    The cached copy is merged into the session without loading, so it is the
+    same object relationships and queries return for that user.
+    """
+    version = get_version(user_tag(user_id))
+    entry = _get_cache().get(user_id)
+    if entry is not None and entry[0] == version:
+        user = User(**entry[1])
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    use_primary()
+    user = db.session.get(User, user_id)
+    if user is not None:
+        fields = {name: getattr(user, name) for name in CACHED_FIELDS}
+        _get_cache().set(user_id, (version, fields), app.config['USER_CACHE_TTL'])
+    return user
+
+
+
+@login.user_loader
+def load_user(id):
+    return get_user(int(id))
+
+
+
+def invalidate_user(user_id):
+    # Other processes on the host notice the new version; the TTL covers other hosts
+    _get_cache().delete(user_id)
+    bump_version(user_tag(user_id))
+
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_changed_users(session, flush_context):
+    # Profile edits and the profile image worker. A user is also dirty when
+    # only a relationship changed (a new message, booking or review), which
+    # leaves the cached fields as they were.
+    changed = session.info.setdefault('changed_users', set())
+    for obj in session.dirty:
+        if isinstance(obj, User) and any(inspect(obj).attrs[name].history.has_changes() for name in CACHED_FIELDS):
+            changed.add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, User):
+            changed.add(obj.id)
+
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_changed_users(session):
+    for user_id in session.info.pop('changed_users', ()):
+        invalidate_user(user_id)
+
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_changed_users(session):
+    if session.in_nested_transaction():
+        return
+    session.info.pop('changed_users', None)
@@ -0,0 +1,153 @@
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import url_for
+from PIL import Image, ImageOps
+from app import app, db
+from app.models import User
+
+
+ALLOWED_FORMATS = ('JPEG', 'PNG')
+OUTPUT_FORMATS = (('jpg', 'JPEG', {'quality': 85, 'optimize': True}), ('webp', 'WEBP', {'quality': 80, 'method': 4}))
+
+_lock = threading.Lock()
+_executor = None
+_executor_pid = None
+
+
+
+class ImageRejected(Exception):
+    pass
+
+
+
+def _picture_dir():
+    return os.path.join(app.root_path, 'static/profile_pics')
+
+
+
+def _variant_name(key, size, ext):
+    return f'{key}_{size}.{ext}'
+
+
+
+@app.template_global()
+def profile_image_url(profile_image, size=125, ext='jpg'):
+    # Uploads are stored under their content hash with one file per size and
+    # format; older rows and the default still hold a plain filename, which
+    # only exists as a single JPEG/PNG.
+    if '.' in profile_image:
+        if ext != 'jpg':
+            return None
+        filename = profile_image
+    else:
+        filename = _variant_name(profile_image, size, ext)
+    return url_for('static', filename='profile_pics/' + filename)
+
+
+
+def read_upload(form_picture):
+    """Read and sanity-check an upload without decoding its pixels.
+
+    Returns (key, data) where key is the content hash used as the filename.
+    """
+    max_bytes = app.config['PROFILE_IMAGE_MAX_BYTES']
+    data = form_picture.stream.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise ImageRejected(f'Images must be smaller than {max_bytes // (1024 * 1024)} MB.')
+    try:
+        # Image.open only parses the header, so this is cheap even for huge files
+        image = Image.open(io.BytesIO(data))
+    except (OSError, Image.DecompressionBombError):
+        raise ImageRejected('The uploaded file is not a valid image.')
+    if image.format not in ALLOWED_FORMATS:
+        raise ImageRejected('Only JPEG and PNG images are supported.')
+    width, height = image.size
+    if width * height > app.config['PROFILE_IMAGE_MAX_PIXELS']:
+        raise ImageRejected('The uploaded image is too large.')
+    return hashlib.sha256(data).hexdigest()[:16], data
+
+
+
+def variants_exist(key):
+    directory = _picture_dir()
+    return all(
+        os.path.exists(os.path.join(directory, _variant_name(key, size, ext)))
+        for size in app.config['PROFILE_IMAGE_SIZES']
+        for ext, _, _ in OUTPUT_FORMATS
+    )
+
+
+
+def _save_atomic(image, path, image_format, options):
+    # Write to a temp file first so a half-written image is never served
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            image.save(f, image_format, **options)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+
+def generate_variants(key, data):
+    directory = _picture_dir()
+    os.makedirs(directory, exist_ok=True)
+    sizes = sorted(app.config['PROFILE_IMAGE_SIZES'], reverse=True)
+    with Image.open(io.BytesIO(data)) as image:
+        # Let JPEG decode straight at a reduced scale instead of full size
+        image.draft('RGB', (sizes[0], sizes[0]))
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        for size in sizes:
+            # Shrink progressively from the previous, larger variant
+            image.thumbnail((size, size))
+            for ext, image_format, options in OUTPUT_FORMATS:
+                _save_atomic(image, os.path.join(directory, _variant_name(key, size, ext)), image_format, options)
+
+
+
+def _process_and_assign(user_id, key, data):
+    with app.app_context():
+        try:
+            if not variants_exist(key):
+                generate_variants(key, data)
+            user = db.session.get(User, user_id)
+            if user is not None:
+                user.profile_image = key
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            app.logger.exception(f'Error processing profile picture for user {user_id}')
+
+
+
+def _get_executor():
+    global _executor, _executor_pid
+    if _executor_pid != os.getpid():
+        with _lock:
+            if _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(max_workers=app.config['PROFILE_IMAGE_WORKERS'],
+                                               thread_name_prefix='profile-image')
+                _executor_pid = os.getpid()
+    return _executor
+
+
+
+def save_profile_picture(user, form_picture):
+    """Validate an upload and hand resizing off to the image worker pool.
+
+    The user's profile_image switches to the new picture once every variant
+    has been written. Returns True if that already happened (a duplicate
+    of an image that was processed before).
+    """
+    key, data = read_upload(form_picture)
+    if variants_exist(key):
+        user.profile_image = key
+        return True
+    _get_executor().submit(_process_and_assign, user.id, key, data)
+    return False
@@ -0,0 +1,233 @@
+import csv
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+from app import db
+from app.models import User, Gig, Category
+from app.categories import get_categories, invalidate_categories
+from app.geocoding import geocode, normalize_address
+from app.response_cache import invalidate_gig
+
+
+JSONL_EXTENSIONS = ('.jsonl', '.ndjson', '.json')
+
+
+
+class RowError(Exception):
+    pass
+
+
+
+def read_rows(path, file_format=None):
+    """Yield (line number, row dict) from a CSV or JSON Lines file, lazily.
+
+    Lines that can't be parsed are yielded with an '_error' key.
+    """
+    if file_format is None:
+        file_format = 'jsonl' if os.path.splitext(path)[1].lower() in JSONL_EXTENSIONS else 'csv'
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if file_format == 'csv':
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_number, {'_error': f'invalid JSON: {e}'}
+                continue
+            yield line_number, row if isinstance(row, dict) else {'_error': 'not a JSON object'}
+
+
+
+def _text(row, name, max_length=None):
+    value = row.get(name)
+    value = str(value).strip() if value is not None else ''
+    if not value:
+        raise RowError(f'{name} is required')
+    if max_length and len(value) > max_length:
+        raise RowError(f'{name} is longer than {max_length} characters')
+    return value
+
+
+
+def _number(row, name, required=True):
+    value = row.get(name)
+    if value is None or value == '':
+        if required:
+            raise RowError(f'{name} is required')
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        raise RowError(f'{name} is not a number: {value!r}')
+
+
+
+def parse_row(row, default_seller=None):
+    """Check one input row and return the gig's values, with category and
+    seller still as names."""
+    if '_error' in row and len(row) == 1:
+        raise RowError(row['_error'])
+    gig = {
+        'title': _text(row, 'title', Gig.title.type.length),
+        'description': _text(row, 'description'),
+        'price': _number(row, 'price'),
+        'location': _text(row, 'location', Gig.location.type.length),
+        'travel_radius': _number(row, 'travel_radius'),
+        'category': _text(row, 'category'),
+        'seller': str(row.get('seller') or default_seller or '').strip(),
+        'latitude': _number(row, 'latitude', required=False),
+        'longitude': _number(row, 'longitude', required=False),
+    }
+    if not gig['seller']:
+        raise RowError('seller is required (or pass --seller)')
+    if gig['price'] < 0 or gig['travel_radius'] < 0:
+        raise RowError('price and travel_radius must not be negative')
+    if (gig['latitude'] is None) != (gig['longitude'] is None):
+        raise RowError('latitude and longitude must be given together')
+    return gig
+
+
+
+def _geocode_in_context(flask_app, address):
+    # geocode() uses the database cache, so each thread needs its own session
+    with flask_app.app_context():
+        return geocode(address)
+
+
+
+class GigImporter(object):
+    """Insert gigs in batches, geocoding their addresses in parallel.
+
+    Each distinct address (after normalization) is geocoded once per import.
+    Categories are matched by name, case-insensitively, and sellers by
+    username. report(line_number, row, error) is called for every rejected
+    row.
+    """
+    def __init__(self, batch_size=1000, workers=8, default_seller=None, create_categories=False, report=None):
+        self.batch_size = batch_size
+        self.workers = workers
+        self.default_seller = default_seller
+        self.create_categories = create_categories
+        self.report = report or (lambda line_number, row, error: None)
+        self.imported = 0
+        self.failed = 0
+        self._sellers = {}
+        self._locations = {}
+
+    def run(self, rows, progress=None):
+        flask_app = current_app._get_current_object()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='import-geocode') as executor:
+            batch = []
+            for line_number, row in rows:
+                batch.append((line_number, row))
+                if len(batch) >= self.batch_size:
+                    self._import_batch(batch, executor, flask_app)
+                    batch = []
+                    if progress:
+                        progress(self)
+            if batch:
+                self._import_batch(batch, executor, flask_app)
+                if progress:
+                    progress(self)
+        return self.imported, self.failed
+
+    def _reject(self, line_number, row, error):
+        self.failed += 1
+        self.report(line_number, row, str(error))
+
+    def _categories(self, names):
+        categories = {category.name.lower(): category.id for category in get_categories()}
+        missing = {name.lower(): name for name in names if name.lower() not in categories}
+        if missing and self.create_categories:
+            db.session.execute(insert(Category), [{'name': name} for name in sorted(missing.values())])
+            db.session.commit()
+            invalidate_categories()
+            categories = {category.name.lower(): category.id for category in get_categories()}
+        return categories
+
+    def _seller_ids(self, usernames):
+        missing = [username for username in usernames if username not in self._sellers]
+        if missing:
+            for user_id, username in db.session.query(User.id, User.username).filter(User.username.in_(missing)):
+                self._sellers[username] = user_id
+        return self._sellers
+
+    def _geocode(self, gigs, executor, flask_app):
+        # One lookup per distinct address, shared by every row that uses it
+        futures = {}
+        for gig in gigs:
+            if gig['latitude'] is not None:
+                continue
+            key = normalize_address(gig['location'])
+            if key not in self._locations and key not in futures:
+                futures[key] = executor.submit(_geocode_in_context, flask_app, gig['location'])
+        for key, future in futures.items():
+            try:
+                self._locations[key] = future.result()
+            except Exception as e:
+                current_app.logger.error(f'Error geocoding {key!r} during import: {e}')
+                self._locations[key] = None
+
+    def _import_batch(self, batch, executor, flask_app):
+        parsed = []
+        for line_number, row in batch:
+            try:
+                parsed.append((line_number, row, parse_row(row, self.default_seller)))
+            except RowError as e:
+                self._reject(line_number, row, e)
+
+        categories = self._categories({gig['category'] for _, _, gig in parsed})
+        sellers = self._seller_ids({gig['seller'] for _, _, gig in parsed})
+        self._geocode([gig for _, _, gig in parsed], executor, flask_app)
+
+        values = []
+        for line_number, row, gig in parsed:
+            category_id = categories.get(gig['category'].lower())
+            seller_id = sellers.get(gig['seller'])
+            if category_id is None:
+                self._reject(line_number, row, f'unknown category {gig["category"]!r}')
+                continue
+            if seller_id is None:
+                self._reject(line_number, row, f'unknown seller {gig["seller"]!r}')
+                continue
+            latitude, longitude = gig['latitude'], gig['longitude']
+            if latitude is None:
+                coordinates = self._locations.get(normalize_address(gig['location']))
+                if coordinates is None:
+                    self._reject(line_number, row, f'could not geocode {gig["location"]!r}')
+                    continue
+                latitude, longitude = coordinates
+            values.append((line_number, row, {
+                'seller_id': seller_id, 'category_id': category_id, 'title': gig['title'],
+                'description': gig['description'], 'price': gig['price'], 'location': gig['location'],
+                'travel_radius': gig['travel_radius'], 'latitude': latitude, 'longitude': longitude,
+            }))
+        if values:
+            self._insert(values)
+
+    def _insert(self, values):
+        try:
+            db.session.execute(insert(Gig), [gig for _, _, gig in values])
+            db.session.commit()
+            self.imported += len(values)
+        except SQLAlchemyError:
+            db.session.rollback()
+            if len(values) == 1:
+                line_number, row, _ = values[0]
+                self._reject(line_number, row, 'database rejected the row')
+                return
+            # Split the batch to find the rows the database refuses
+            middle = len(values) // 2
+            self._insert(values[:middle])
+            self._insert(values[middle:])
+            return
+        # Core inserts skip the ORM events that normally expire cached pages
+        invalidate_gig()
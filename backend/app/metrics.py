@@ -0,0 +1,212 @@
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, request, has_request_context, abort, Response, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app import app
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+
+class Histogram(object):
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+
+class Registry(object):
+    """Per-process metrics, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.help = {}
+
+    def describe(self, name, kind, text):
+        self.help[name] = (kind, text)
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, (kind, text) in sorted(self.help.items()):
+                lines.append(f'# HELP {name} {text}')
+                lines.append(f'# TYPE {name} {kind}')
+                if kind == 'histogram':
+                    for (metric, labels), histogram in sorted(self.histograms.items()):
+                        if metric != name:
+                            continue
+                        cumulative = 0
+                        for bound, count in zip(histogram.buckets, histogram.counts):
+                            cumulative += count
+                            lines.append(f'{name}_bucket{_labels(labels, le=bound)} {cumulative}')
+                        lines.append(f'{name}_bucket{_labels(labels, le="+Inf")} {histogram.count}')
+                        lines.append(f'{name}_sum{_labels(labels)} {histogram.sum}')
+                        lines.append(f'{name}_count{_labels(labels)} {histogram.count}')
+                else:
+                    for (metric, labels), value in sorted(self.counters.items()):
+                        if metric == name:
+                            lines.append(f'{name}{_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+
+def _labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+
+registry = Registry()
+registry.describe('gigagig_request_duration_seconds', 'histogram', 'Request latency by endpoint.')
+registry.describe('gigagig_requests_total', 'counter', 'Requests by endpoint and status code.')
+registry.describe('gigagig_sql_queries_total', 'counter', 'SQL statements executed by endpoint.')
+registry.describe('gigagig_sql_duration_seconds_total', 'counter', 'Time spent in SQL statements by endpoint.')
+registry.describe('gigagig_template_render_seconds', 'histogram', 'Jinja render time by endpoint.')
+registry.describe('gigagig_outbound_duration_seconds', 'histogram', 'Outbound HTTP call latency by upstream.')
+registry.describe('gigagig_outbound_seconds_total', 'counter', 'Time spent in outbound calls by endpoint and upstream.')
+
+
+
+def _endpoint():
+    return request.endpoint or 'unmatched'
+
+
+
+@contextmanager
+def track_outbound(upstream):
+    """Time a call to an external service (geocode, mailgun, stripe)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        registry.observe('gigagig_outbound_duration_seconds', {'upstream': upstream}, elapsed)
+        if has_request_context() and 'metrics' in g:
+            outbound = g.metrics['outbound']
+            outbound[upstream] = outbound.get(upstream, 0) + elapsed
+
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # On the execution context, not conn.info: after_cursor_execute doesn't
+    # run when a statement raises, and a pooled connection outlives the error
+    context.metrics_query_start = time.perf_counter()
+
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context.metrics_query_start
+    if has_request_context() and 'metrics' in g:
+        g.metrics['sql_count'] += 1
+        g.metrics['sql_time'] += elapsed
+        if app.config['SLOW_REQUEST_THRESHOLD']:
+            g.metrics['queries'].append((elapsed, statement))
+
+
+
+@before_render_template.connect_via(app)
+def _before_render(sender, template, context, **extra):
+    if 'metrics' in g:
+        g.metrics['render_start'].append(time.perf_counter())
+
+
+
+@template_rendered.connect_via(app)
+def _after_render(sender, template, context, **extra):
+    if 'metrics' in g and g.metrics['render_start']:
+        g.metrics['render_time'] += time.perf_counter() - g.metrics['render_start'].pop()
+
+
+
+@app.before_request
+def start_request_metrics():
+    g.metrics = {
+        'start': time.perf_counter(),
+        'sql_count': 0,
+        'sql_time': 0.0,
+        'render_time': 0.0,
+        'render_start': [],
+        'outbound': {},
+        'queries': [],
+        'status': 500,
+    }
+
+
+
+@app.after_request
+def record_response_status(response):
+    if 'metrics' in g:
+        g.metrics['status'] = response.status_code
+    return response
+
+
+
+@app.teardown_request
+def record_request_metrics(exc):
+    metrics = g.pop('metrics', None)
+    if metrics is None:
+        return
+    elapsed = time.perf_counter() - metrics['start']
+    endpoint = _endpoint()
+    labels = {'endpoint': endpoint}
+    registry.observe('gigagig_request_duration_seconds', {'endpoint': endpoint, 'method': request.method}, elapsed)
+    registry.inc('gigagig_requests_total', {'endpoint': endpoint, 'method': request.method, 'status': metrics['status']})
+    registry.inc('gigagig_sql_queries_total', labels, metrics['sql_count'])
+    registry.inc('gigagig_sql_duration_seconds_total', labels, metrics['sql_time'])
+    if metrics['render_time']:
+        registry.observe('gigagig_template_render_seconds', labels, metrics['render_time'])
+    for upstream, seconds in metrics['outbound'].items():
+        registry.inc('gigagig_outbound_seconds_total', {'endpoint': endpoint, 'upstream': upstream}, seconds)
+
+    threshold = app.config['SLOW_REQUEST_THRESHOLD']
+    if threshold and elapsed >= threshold:
+        top = sorted(metrics['queries'], key=lambda q: q[0], reverse=True)[:app.config['SLOW_REQUEST_TOP_QUERIES']]
+        details = ''.join(f'\n  {seconds * 1000:.1f}ms {" ".join(statement.split())}' for seconds, statement in top)
+        app.logger.warning(
+            f'Slow request {request.method} {request.path} ({endpoint}): {elapsed * 1000:.1f}ms, '
+            f'{metrics["sql_count"]} queries in {metrics["sql_time"] * 1000:.1f}ms, '
+            f'render {metrics["render_time"] * 1000:.1f}ms, '
+            f'outbound {sum(metrics["outbound"].values()) * 1000:.1f}ms{details}'
+        )
+
+
+
+@app.route('/metrics')
+def metrics():
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        abort(403)
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
@@ -1,8 +1,11 @@
 from datetime import datetime
-from app import db, login
+from app import db
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 from sqlalchemy.orm import relationship
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.hybrid import hybrid_property
 
 
 
@@ -15,6 +18,9 @@ class User(UserMixin, db.Model):
     last_seen = db.Column(db.DateTime, default=datetime.utcnow)
     member_since = db.Column(db.DateTime, default=datetime.utcnow)
     profile_image = db.Column(db.String(20), nullable=False, default='default.jpg')
+    # Bumped whenever a booking for this seller is made or declined. The
+    # UPDATE doubles as a per-seller lock (see app/availability.py).
+    calendar_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     gigs = db.relationship('Gig', back_populates='seller', lazy='dynamic')
 
     def set_password(self, password):
@@ -28,12 +34,6 @@ class User(UserMixin, db.Model):
 
 
 
-@login.user_loader
-def load_user(id):
-    return User.query.get(int(id))
-
-
-
 class Gig(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     seller_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -45,21 +45,40 @@ class Gig(db.Model):
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
+    rating_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
     category = db.relationship('Category', back_populates='gigs')
 
     seller = db.relationship('User', back_populates='gigs')
 
+    __table_args__ = (
+        db.Index('ix_gig_latitude_longitude', 'latitude', 'longitude'),
+        db.Index('ix_gig_seller_id_timestamp', 'seller_id', 'timestamp'),
+        db.Index('ix_gig_category_id_timestamp', 'category_id', 'timestamp'),
+    )
+
     def __repr__(self):
         return f'<Gig {self.title}>'
     
-    @property
+    @hybrid_property
     def average_rating(self):
-        if self.reviews:
-            total = sum(review.rating for review in self.reviews)
-            return round(total / len(self.reviews), 2)
+        if self.rating_count:
+            return round(self.rating_sum / self.rating_count, 2)
         return None
+
+    @average_rating.expression
+    def average_rating(cls):
+        return db.case(
+            (cls.rating_count > 0, db.cast(cls.rating_sum, db.Float) / cls.rating_count),
+            else_=None
+        )
+
+    def add_rating(self, rating):
+        # Increment in SQL so concurrent reviews don't overwrite each other
+        self.rating_count = Gig.rating_count + 1
+        self.rating_sum = Gig.rating_sum + rating
     
 
 
@@ -79,6 +98,7 @@ class Message(db.Model):
     recipient_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     body = db.Column(db.String(500), nullable=False)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id', name='fk_message_conversation_id_conversation'))
     sender = db.relationship(
         'User',
         foreign_keys=[sender_id],
@@ -90,23 +110,142 @@ class Message(db.Model):
         backref=db.backref('received_messages', lazy='dynamic')
     )
 
+    __table_args__ = (
+        db.Index('ix_message_recipient_id_timestamp', 'recipient_id', 'timestamp'),
+        db.Index('ix_message_conversation_id_timestamp', 'conversation_id', 'timestamp'),
+    )
+
     def __repr__(self):
         return f'<Message {self.body}>'
 
 
 
+class Conversation(db.Model):
+    """Summary of the messages between two users, kept up to date on send.
+
+    user_a is always the user with the lower id, so each pair has one row.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    user_a_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_b_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    last_message_body = db.Column(db.String(500))
+    last_sender_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    last_message_at = db.Column(db.DateTime)
+    unread_a = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    unread_b = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    user_a = db.relationship('User', foreign_keys=[user_a_id])
+    user_b = db.relationship('User', foreign_keys=[user_b_id])
+    messages = db.relationship('Message', backref='conversation', lazy='dynamic')
+
+    __table_args__ = (
+        db.UniqueConstraint('user_a_id', 'user_b_id', name='uq_conversation_user_a_id_user_b_id'),
+        db.Index('ix_conversation_user_a_id_last_message_at', 'user_a_id', 'last_message_at'),
+        db.Index('ix_conversation_user_b_id_last_message_at', 'user_b_id', 'last_message_at'),
+    )
+
+    @staticmethod
+    def pair(user_id, other_id):
+        return min(user_id, other_id), max(user_id, other_id)
+
+    @classmethod
+    def between(cls, user, other):
+        """Get or create the conversation of two users."""
+        user_a_id, user_b_id = cls.pair(user.id, other.id)
+        conversation = cls.query.filter_by(user_a_id=user_a_id, user_b_id=user_b_id).first()
+        if conversation is None:
+            try:
+                # A savepoint, so a lost race leaves the caller's transaction alone
+                with db.session.begin_nested():
+                    conversation = cls(user_a_id=user_a_id, user_b_id=user_b_id)
+                    db.session.add(conversation)
+                    db.session.flush()
+            except IntegrityError:
+                # Their first messages crossed; use the row the other one made
+                conversation = cls.query.filter_by(user_a_id=user_a_id, user_b_id=user_b_id).one()
+        return conversation
+
+    @classmethod
+    def sides(cls, user):
+        # One condition per column user can be in, each with its own index
+        return [cls.user_a_id == user.id, cls.user_b_id == user.id]
+
+    def other_user(self, user):
+        return self.user_b if self.user_a_id == user.id else self.user_a
+
+    def unread_for(self, user):
+        return self.unread_a if self.user_a_id == user.id else self.unread_b
+
+    def add_message(self, message):
+        message.conversation = self
+        message.timestamp = message.timestamp or datetime.utcnow()
+        self.last_message_body = message.body
+        self.last_sender_id = message.sender.id
+        self.last_message_at = message.timestamp
+        # Incremented in SQL so messages sent at the same time are all counted
+        if message.recipient.id == self.user_a_id:
+            self.unread_a = Conversation.unread_a + 1
+        else:
+            self.unread_b = Conversation.unread_b + 1
+
+    def mark_read(self, user):
+        if self.user_a_id == user.id:
+            self.unread_a = 0
+        else:
+            self.unread_b = 0
+
+    def __repr__(self):
+        return f'<Conversation {self.user_a_id} {self.user_b_id}>'
+
+
+
 class Booking(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     gig_id = db.Column(db.Integer, db.ForeignKey('gig.id'), nullable=False)
     buyer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # Copied from the gig, for the per-seller calendar index
+    seller_id = db.Column(db.Integer, db.ForeignKey('user.id', name='fk_booking_seller_id_user'), nullable=False)
     booking_date = db.Column(db.DateTime, nullable=False)
+    duration = db.Column(db.Integer, nullable=False, default=60, server_default='60')  # minutes
+    end_date = db.Column(db.DateTime, nullable=False)
     status = db.Column(db.String(20), default='Pending')
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    # Last Stripe Checkout session, reused until it expires
+    checkout_session_id = db.Column(db.String(255))
+    checkout_url = db.Column(db.Text)
+    checkout_amount = db.Column(db.Integer)
+    checkout_expires_at = db.Column(db.DateTime)
 
     gig = db.relationship('Gig', backref='bookings')
-    buyer = db.relationship('User', backref='purchases')
+    buyer = db.relationship('User', backref='purchases', foreign_keys=[buyer_id])
     review = db.relationship('Review', backref='booking', uselist=False)
 
+    __table_args__ = (
+        db.Index('ix_booking_buyer_id_timestamp', 'buyer_id', 'timestamp'),
+        db.Index('ix_booking_gig_id_timestamp', 'gig_id', 'timestamp'),
+        db.Index('ix_booking_seller_id_booking_date', 'seller_id', 'booking_date'),
+        db.Index('ix_booking_seller_id_timestamp', 'seller_id', 'timestamp'),
+    )
+
+    def change_status(self, old_status, new_status):
+        """Move the booking from old_status to new_status, unless another request did first.
+
+        The UPDATE only matches while the row still has old_status, so of two
+        requests racing on one booking exactly one gets True and should count
+        and announce the change. The loser's copy is reloaded.
+        """
+        result = db.session.execute(
+            db.update(Booking)
+            .where(Booking.id == self.id, Booking.status == old_status)
+            .values(status=new_status)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount != 1:
+            db.session.refresh(self, ['status'])
+            return False
+        set_committed_value(self, 'status', new_status)
+        return True
+
     def __repr__(self):
         return f'<Booking {self.id} - {self.status}>'
     
@@ -123,4 +262,104 @@ class Review(db.Model):
 
     gig = db.relationship('Gig', backref='reviews')
     #booking = db.relationship('Booking', backref='review')
-    user = db.relationship('User', backref='reviews')
\ No newline at end of file
+    user = db.relationship('User', backref='reviews')
+
+    __table_args__ = (
+        db.Index('ix_review_gig_id_timestamp', 'gig_id', 'timestamp'),
+    )
+
+
+
+class GeocodeCache(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    address_key = db.Column(db.String(255), index=True, unique=True, nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<GeocodeCache {self.address_key} {self.status}>'
+
+
+
+class OutboxEmail(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    to_email = db.Column(db.String(120), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    html_content = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='Pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claim_token = db.Column(db.String(32), index=True)
+    last_error = db.Column(db.Text)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_outbox_email_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+    def __repr__(self):
+        return f'<OutboxEmail {self.id} {self.to_email} - {self.status}>'
+
+
+
+class StripeEvent(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.String(255), unique=True, nullable=False)
+    type = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='Pending')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    claim_token = db.Column(db.String(32), index=True)
+    last_error = db.Column(db.Text)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_stripe_event_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+
+    def __repr__(self):
+        return f'<StripeEvent {self.event_id} {self.type} - {self.status}>'
+
+
+
+class Notification(db.Model):
+    """Recent events for the database notification backend; pruned after a while."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    type = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Notification {self.type} for {self.user_id}>'
+
+
+
+class SellerDailyStats(db.Model):
+    """Per-seller daily counters behind the dashboard.
+
+    Booking counts are bucketed by the day the booking was requested and
+    follow it through its statuses; reviews by the day they were written.
+    Updated in the same transaction as the change (see app/seller_stats.py)
+    and rebuilt with `flask rebuild-seller-stats`.
+    """
+    seller_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    requested = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    pending = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    accepted = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    declined = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    confirmed = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    completed = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    revenue = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # cents
+    review_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    def __repr__(self):
+        return f'<SellerDailyStats {self.seller_id} {self.day}>'
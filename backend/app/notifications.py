@@ -0,0 +1,234 @@
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import Response, current_app, has_request_context, url_for
+from flask_login import login_required, current_user
+from sqlalchemy import event
+from app import app, db
+from app.models import Notification
+
+
+# Events a slow client hasn't read yet; newer ones are dropped past this
+QUEUE_SIZE = 100
+
+
+
+class Broker(object):
+    """Fans events out to the open streams of this process."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def subscribe(self, user_id):
+        stream = queue.Queue(QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(stream)
+        return stream
+
+    def unsubscribe(self, user_id, stream):
+        with self._lock:
+            streams = self._subscribers.get(user_id)
+            if streams is not None:
+                streams.discard(stream)
+                if not streams:
+                    del self._subscribers[user_id]
+
+    def listening(self, user_id):
+        return user_id in self._subscribers
+
+    def deliver(self, user_id, notification):
+        with self._lock:
+            streams = list(self._subscribers.get(user_id, ()))
+        for stream in streams:
+            try:
+                stream.put_nowait(notification)
+            except queue.Full:
+                pass
+
+
+
+broker = Broker()
+
+
+
+class MemoryBackend(object):
+    """Delivers straight to this process's streams. Only for a single process."""
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def publish(self, session, user_id, notification):
+        session.info.setdefault('notifications', []).append((user_id, notification))
+
+    def committed(self, session):
+        for user_id, notification in session.info.pop('notifications', ()):
+            with self._lock:
+                notification['id'] = next(self._ids)
+            broker.deliver(user_id, notification)
+
+    def start(self):
+        pass
+
+
+
+class DatabaseBackend(object):
+    """Writes notifications to a table that every process polls.
+
+    Rows are added in the same transaction as the change they announce, so
+    nothing is sent for changes that are rolled back.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pid = None
+
+    def publish(self, session, user_id, notification):
+        session.add(Notification(user_id=user_id, type=notification['type'],
+                                 payload=json.dumps(notification['data'])))
+        session.info['notification_queued'] = True
+
+    def committed(self, session):
+        if session.info.pop('notification_queued', False):
+            self._wake.set()
+
+    def start(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            flask_app = current_app._get_current_object()
+            # Only rows written from now on; streams don't replay history
+            last_id = db.session.query(db.func.max(Notification.id)).scalar() or 0
+            threading.Thread(target=self._run, args=(flask_app, last_id), name='notifications', daemon=True).start()
+
+    def _run(self, flask_app, last_id):
+        with flask_app.app_context():
+            retention = timedelta(seconds=flask_app.config['NOTIFICATION_RETENTION'])
+            pruned_at = 0
+            while True:
+                try:
+                    rows = Notification.query.filter(Notification.id > last_id) \
+                        .order_by(Notification.id).limit(500).all()
+                    for row in rows:
+                        last_id = row.id
+                        if broker.listening(row.user_id):
+                            broker.deliver(row.user_id, {'id': row.id, 'type': row.type, 'data': json.loads(row.payload)})
+                    if time.monotonic() - pruned_at > retention.total_seconds():
+                        Notification.query.filter(Notification.timestamp < datetime.utcnow() - retention) \
+                            .delete(synchronize_session=False)
+                        pruned_at = time.monotonic()
+                    db.session.commit()
+                except Exception:
+                    flask_app.logger.exception('Error polling notifications')
+                    db.session.rollback()
+                    rows = []
+                if len(rows) < 500:
+                    self._wake.wait(flask_app.config['NOTIFICATION_POLL_INTERVAL'])
+                    self._wake.clear()
+
+
+
+# Other backends (e.g. Redis pub/sub) can be added here by name
+BACKENDS = {
+    'memory': MemoryBackend,
+    'database': DatabaseBackend,
+}
+
+_backends = {}
+
+
+
+def get_backend():
+    name = app.config['NOTIFICATION_BACKEND']
+    backend = _backends.get(name)
+    if backend is None:
+        backend = _backends[name] = BACKENDS[name]()
+    return backend
+
+
+
+def _path(endpoint, **values):
+    # Workers publish without a request, where url_for can't build URLs
+    if has_request_context():
+        return url_for(endpoint, **values)
+    return app.url_map.bind('localhost', script_name=app.config['APPLICATION_ROOT']).build(endpoint, values)
+
+
+
+def notify(user_id, event_type, **data):
+    """Push an event to a user's open streams once the current transaction commits."""
+    get_backend().publish(db.session, user_id, {'type': event_type, 'data': data})
+
+
+
+def notify_message(message):
+    notify(message.recipient.id, 'new_message', sender=message.sender.username, body=message.body[:140],
+           url=_path('conversation', username=message.sender.username))
+
+
+
+def notify_booking(booking, *user_ids):
+    for user_id in user_ids:
+        notify(user_id, 'booking', booking_id=booking.id, status=booking.status, gig=booking.gig.title,
+               url=_path('booking_detail', booking_id=booking.id))
+
+
+
+@event.listens_for(db.session, 'after_commit')
+def send_committed_notifications(session):
+    get_backend().committed(session)
+
+
+
+@event.listens_for(db.session, 'after_rollback')
+def drop_notifications(session):
+    # A savepoint's rollback leaves the transaction's own changes in place
+    if session.in_nested_transaction():
+        return
+    session.info.pop('notifications', None)
+    session.info.pop('notification_queued', None)
+
+
+
+def _format(notification):
+    return f'id: {notification["id"]}\nevent: {notification["type"]}\ndata: {json.dumps(notification["data"])}\n\n'
+
+
+
+@app.route('/notifications/stream')
+@login_required
+def notification_stream():
+    """Server-Sent Events for the current user.
+
+    The stream ends after NOTIFICATION_STREAM_DURATION seconds and the browser
+    reconnects, so a worker thread is never tied up indefinitely.
+    """
+    get_backend().start()
+    user_id = current_user.id
+    heartbeat = current_app.config['NOTIFICATION_HEARTBEAT']
+    duration = current_app.config['NOTIFICATION_STREAM_DURATION']
+
+    def generate():
+        # Runs after the request context is gone, so it holds no database session
+        stream = broker.subscribe(user_id)
+        try:
+            yield 'retry: 3000\n\n'
+            deadline = time.monotonic() + duration
+            while time.monotonic() < deadline:
+                try:
+                    notification = stream.get(timeout=min(heartbeat, max(deadline - time.monotonic(), 0.1)))
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield _format(notification)
+        finally:
+            broker.unsubscribe(user_id, stream)
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
@@ -0,0 +1,186 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+import requests
+import stripe
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from flask import current_app
+from app.metrics import track_outbound
+
+
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+RETRY_STATUSES = (502, 503, 504)
+
+
+
+def _connection_refused(error):
+    reason = getattr(error.args[0], 'reason', None) if error is not None and error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised without touching the network while an upstream's breaker is open."""
+
+
+
+class CircuitBreaker(object):
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            # Half-open: let a single trial request through after the cooldown
+            if time.monotonic() - self.opened_at >= self.cooldown and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.trial_running = False
+            if self.opened_at is not None or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+
+
+class RetryBudget(object):
+    # Every request earns `ratio` of a retry, capped at `cap`, so retries can
+    # never be more than a fixed fraction of traffic to a struggling upstream.
+    def __init__(self, ratio, cap=10):
+        self.ratio = ratio
+        self.cap = cap
+        self.tokens = cap
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.cap, self.tokens + self.ratio)
+
+    def withdraw(self):
+        with self._lock:
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+
+
+class Upstream(object):
+    def __init__(self, name, config):
+        self.name = name
+        self.timeout = (config['OUTBOUND_CONNECT_TIMEOUT'], config['OUTBOUND_READ_TIMEOUT'])
+        self.retries = config['OUTBOUND_RETRIES']
+        self.breaker = CircuitBreaker(config['OUTBOUND_BREAKER_THRESHOLD'], config['OUTBOUND_BREAKER_COOLDOWN'])
+        self.budget = RetryBudget(config['OUTBOUND_RETRY_BUDGET'])
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=config['OUTBOUND_POOL_SIZE'])
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @contextmanager
+    def guard(self):
+        """Run one call under this upstream's circuit breaker and metrics."""
+        if not self.breaker.allow():
+            raise CircuitOpenError(f'{self.name} is unavailable (circuit open)')
+        try:
+            with track_outbound(self.name):
+                yield
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+
+    def _retryable(self, method, error=None, response=None):
+        if isinstance(error, CircuitOpenError):
+            return False
+        if method in IDEMPOTENT_METHODS:
+            if error is not None:
+                return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+            return response.status_code in RETRY_STATUSES
+        # Anything else is only retried when the request was never sent
+        return isinstance(error, requests.exceptions.ConnectTimeout) or _connection_refused(error)
+
+    def request(self, method, url, **kwargs):
+        method = method.upper()
+        kwargs.setdefault('timeout', self.timeout)
+        self.budget.deposit()
+        attempt = 0
+        while True:
+            try:
+                with self.guard():
+                    response = self.session.request(method, url, **kwargs)
+                    if response.status_code >= 500:
+                        # Count server errors against the breaker
+                        response.raise_for_status()
+                return response
+            except requests.exceptions.HTTPError as e:
+                if attempt < self.retries and self._retryable(method, response=e.response) and self.budget.withdraw():
+                    attempt += 1
+                    time.sleep(min(0.1 * 2 ** attempt, 1))
+                    continue
+                return e.response
+            except requests.exceptions.RequestException as e:
+                if attempt < self.retries and self._retryable(method, error=e) and self.budget.withdraw():
+                    attempt += 1
+                    time.sleep(min(0.1 * 2 ** attempt, 1))
+                    continue
+                raise
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+
+
+_lock = threading.Lock()
+_upstreams = {}
+
+
+
+def get_upstream(name):
+    """Shared client for an external service, created once per process."""
+    key = (os.getpid(), name)
+    upstream = _upstreams.get(key)
+    if upstream is None:
+        with _lock:
+            upstream = _upstreams.get(key)
+            if upstream is None:
+                upstream = _upstreams[key] = Upstream(name, current_app.config)
+    return upstream
+
+
+
+_stripe_pid = None
+
+
+
+def get_stripe_upstream():
+    """get_upstream('stripe'), with the Stripe SDK pointed at its pooled session."""
+    global _stripe_pid
+    upstream = get_upstream('stripe')
+    if _stripe_pid != os.getpid():
+        with _lock:
+            stripe.default_http_client = stripe.RequestsClient(timeout=upstream.timeout, session=upstream.session)
+            # The SDK retries with idempotency keys, so POSTs are safe to retry
+            stripe.max_network_retries = upstream.retries
+            _stripe_pid = os.getpid()
+    return upstream
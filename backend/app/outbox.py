@@ -0,0 +1,162 @@
+import atexit
+import os
+import random
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import event, select, update
+from app import app, db
+from app.models import OutboxEmail
+from app.email import send_email, mailgun_configured, EmailDeliveryError
+
+
+MAX_BACKOFF = 6 * 3600
+
+_lock = threading.Lock()
+_wake = threading.Event()
+_stop = threading.Event()
+_worker_pid = None
+_worker_thread = None
+
+
+
+def claim_batch(limit):
+    # Lease due emails to this worker with a single UPDATE so several workers
+    # (threads or processes) never pick up the same row. If a worker dies the
+    # lease runs out and the email becomes due again.
+    token = uuid.uuid4().hex
+    now = datetime.utcnow()
+    lease = timedelta(seconds=current_app.config['EMAIL_OUTBOX_LEASE'])
+    due = select(OutboxEmail.id) \
+        .where(OutboxEmail.status == 'Pending', OutboxEmail.next_attempt_at <= now) \
+        .order_by(OutboxEmail.next_attempt_at) \
+        .limit(limit)
+    db.session.execute(
+        update(OutboxEmail)
+        .where(OutboxEmail.id.in_(due), OutboxEmail.status == 'Pending', OutboxEmail.next_attempt_at <= now)
+        .values(claim_token=token, next_attempt_at=now + lease)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return OutboxEmail.query.filter_by(claim_token=token).all()
+
+
+
+def _deliver(flask_app, to_email, subject, html_content):
+    with flask_app.app_context():
+        try:
+            send_email(to_email, subject, html_content)
+        except EmailDeliveryError as e:
+            return e
+    return None
+
+
+
+def process_batch(executor):
+    """Deliver one batch of due emails. Returns how many were attempted."""
+    emails = claim_batch(current_app.config['EMAIL_OUTBOX_BATCH_SIZE'])
+    if not emails:
+        return 0
+
+    app_obj = current_app._get_current_object()
+    futures = [
+        executor.submit(_deliver, app_obj, email.to_email, email.subject, email.html_content)
+        for email in emails
+    ]
+
+    max_attempts = current_app.config['EMAIL_OUTBOX_MAX_ATTEMPTS']
+    backoff = current_app.config['EMAIL_OUTBOX_BACKOFF']
+    for email, future in zip(emails, futures):
+        error = future.result()
+        now = datetime.utcnow()
+        email.attempts += 1
+        email.claim_token = None
+        if error is None:
+            email.status = 'Sent'
+            email.sent_at = now
+            email.last_error = None
+        elif error.permanent or email.attempts >= max_attempts:
+            email.status = 'Dead'
+            email.last_error = str(error)
+            current_app.logger.error(f'Giving up on outbox email {email.id}: {error}')
+        else:
+            delay = min(backoff * 2 ** (email.attempts - 1), MAX_BACKOFF) * random.uniform(1, 1.25)
+            email.next_attempt_at = now + timedelta(seconds=delay)
+            email.last_error = str(error)
+    db.session.commit()
+    return len(emails)
+
+
+
+def run_worker(once=False):
+    """Drain the outbox until stopped, or until it is empty if once is set."""
+    with ThreadPoolExecutor(max_workers=current_app.config['EMAIL_OUTBOX_WORKERS']) as executor:
+        while not _stop.is_set():
+            processed = 0
+            if mailgun_configured():
+                try:
+                    processed = process_batch(executor)
+                except Exception:
+                    current_app.logger.exception('Error processing email outbox')
+                    db.session.rollback()
+            if processed:
+                continue
+            if once:
+                break
+            _wake.wait(current_app.config['EMAIL_OUTBOX_POLL_INTERVAL'])
+            _wake.clear()
+
+
+
+def _run_in_app(flask_app):
+    with flask_app.app_context():
+        run_worker()
+
+
+
+def start_worker(flask_app):
+    # One background dispatcher per process; re-checked by pid so a forked
+    # worker process starts its own instead of assuming the parent's.
+    global _worker_pid, _worker_thread
+    if _worker_pid == os.getpid():
+        return
+    with _lock:
+        if _worker_pid == os.getpid():
+            return
+        _worker_pid = os.getpid()
+        _stop.clear()
+        _worker_thread = threading.Thread(target=_run_in_app, args=(flask_app,), name='email-outbox', daemon=True)
+        _worker_thread.start()
+
+
+
+@atexit.register
+def stop_worker():
+    _stop.set()
+    _wake.set()
+    if _worker_thread is not None and _worker_pid == os.getpid():
+        _worker_thread.join(timeout=app.config['OUTBOUND_READ_TIMEOUT'])
+
+
+
+@app.before_request
+def start_outbox_worker():
+    if app.config['EMAIL_OUTBOX_IN_PROCESS']:
+        start_worker(app)
+
+
+
+@event.listens_for(db.session, 'after_commit')
+def wake_outbox_worker(session):
+    if session.info.pop('outbox_queued', False):
+        _wake.set()
+
+
+
+@event.listens_for(db.session, 'after_rollback')
+def clear_outbox_flag(session):
+    if session.in_nested_transaction():
+        return
+    session.info.pop('outbox_queued', None)
@@ -0,0 +1,153 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from operator import itemgetter
+from flask import abort, current_app
+from sqlalchemy import and_, or_, select, union_all
+
+
+
+class Page(object):
+    def __init__(self, items, cursor, next_cursor):
+        self.items = items
+        self.cursor = cursor
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        return datetime.fromisoformat(value['dt'])
+    return value
+
+
+
+def encode_cursor(values):
+    payload = json.dumps([_encode_value(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+
+def decode_cursor(cursor, size):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        values = [_decode_value(v) for v in values]
+    except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError):
+        abort(400)
+    if not isinstance(values, list) or len(values) != size:
+        abort(400)
+    return values
+
+
+
+def _after(order_by, values):
+    # Rows strictly after `values` in the given ordering. The leading key gets
+    # a plain range bound as well so the database can seek on its index.
+    first_column, first_desc = order_by[0]
+    clauses = [first_column <= values[0] if first_desc else first_column >= values[0]]
+    branches = []
+    for i, (column, descending) in enumerate(order_by):
+        equal = [order_by[j][0] == values[j] for j in range(i)]
+        beyond = column < values[i] if descending else column > values[i]
+        branches.append(and_(*equal, beyond))
+    clauses.append(or_(*branches))
+    return and_(*clauses)
+
+
+
+def keyset_paginate(query, order_by, cursor=None, per_page=None, filter_fn=None):
+    """Return one Page of query ordered by order_by, starting after cursor.
+
+    order_by is a list of (column, descending) pairs whose last column must be
+    unique, e.g. [(Message.timestamp, True), (Message.id, True)]. filter_fn,
+    if given, drops items in Python after they are loaded; more rows are
+    fetched until the page is full.
+    """
+    if per_page is None:
+        per_page = current_app.config['ITEMS_PER_PAGE']
+    columns = [column for column, _ in order_by]
+
+    query = query.add_columns(*columns).order_by(
+        *[column.desc() if descending else column.asc() for column, descending in order_by]
+    )
+    position = decode_cursor(cursor, len(columns)) if cursor else None
+
+    rows = []
+    batch_size = per_page + 1 if filter_fn is None else per_page * 4
+    while len(rows) <= per_page:
+        batch_query = query.filter(_after(order_by, position)) if position else query
+        batch = batch_query.limit(batch_size).all()
+        if not batch:
+            break
+        position = list(batch[-1][1:])
+        if filter_fn is None:
+            rows.extend(batch)
+        else:
+            keep = set(map(id, filter_fn([row[0] for row in batch])))
+            rows.extend(row for row in batch if id(row[0]) in keep)
+        if len(batch) < batch_size:
+            break
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1][1:])
+    return Page([row[0] for row in rows], cursor, next_cursor)
+
+
+
+def keyset_paginate_union(query, conditions, order_by, cursor=None, per_page=None):
+    """Like keyset_paginate, for rows of query matching any of conditions.
+
+    Each condition is read in order on its own, up to a page, and the reads
+    are combined with UNION ALL, so an OR across separately indexed columns
+    stops at LIMIT instead of sorting every match. The last order_by column
+    must be the primary key; the page's rows are then loaded through query.
+    """
+    if per_page is None:
+        per_page = current_app.config['ITEMS_PER_PAGE']
+    columns = [column for column, _ in order_by]
+    ordering = [column.desc() if descending else column.asc() for column, descending in order_by]
+    position = decode_cursor(cursor, len(columns)) if cursor else None
+
+    branches = []
+    for condition in conditions:
+        branch = select(*columns).where(condition)
+        if position:
+            branch = branch.where(_after(order_by, position))
+        # SQLite only allows ORDER BY and LIMIT on a compound select's members in a subquery
+        branches.append(select(branch.order_by(*ordering).limit(per_page + 1).subquery()))
+    rows = list(set(query.session.execute(union_all(*branches)).all()))
+    for i in reversed(range(len(order_by))):
+        rows.sort(key=itemgetter(i), reverse=order_by[i][1])
+
+    next_cursor = None
+    if len(rows) > per_page:
+        rows = rows[:per_page]
+        next_cursor = encode_cursor(rows[-1])
+    key_column = columns[-1]
+    keys = [row[-1] for row in rows]
+    loaded = {getattr(item, key_column.key): item for item in query.filter(key_column.in_(keys))} if keys else {}
+    return Page([loaded[key] for key in keys if key in loaded], cursor, next_cursor)
@@ -0,0 +1,302 @@
+import atexit
+import hashlib
+import json
+import os
+import random
+import threading
+import uuid
+from datetime import datetime, timedelta
+import stripe
+from flask import current_app, request, url_for, jsonify, abort
+from sqlalchemy import event, select, update
+from sqlalchemy.exc import IntegrityError
+from app import app, db
+from app.models import Booking, StripeEvent
+from app.outbound import get_stripe_upstream
+from app.notifications import notify_booking
+from app.seller_stats import record_status_change
+
+
+# A stored session is only handed out again if it stays open at least this long
+REUSE_MARGIN = timedelta(minutes=10)
+MAX_BACKOFF = 3600
+
+PAID_EVENTS = ('checkout.session.completed', 'checkout.session.async_payment_succeeded')
+EXPIRED_EVENT = 'checkout.session.expired'
+
+_lock = threading.Lock()
+_wake = threading.Event()
+_stop = threading.Event()
+_worker_pid = None
+_worker_thread = None
+
+
+
+def _checkout_params(booking, amount):
+    return {
+        'payment_method_types': ['card'],
+        'line_items': [{
+            'price_data': {
+                'currency': 'usd',
+                'unit_amount': amount,
+                'product_data': {
+                    'name': booking.gig.title,
+                    'description': booking.gig.description,
+                },
+            },
+            'quantity': 1,
+        }],
+        'mode': 'payment',
+        'client_reference_id': str(booking.id),
+        'metadata': {'booking_id': str(booking.id)},
+        'success_url': url_for('payment_success', booking_id=booking.id, _external=True),
+        'cancel_url': url_for('booking_detail', booking_id=booking.id, _external=True),
+    }
+
+
+
+def _expire_session(session_id):
+    """Close an open Checkout session so it can't be paid as well as its replacement.
+
+    Returns the session if it turns out to have been paid already.
+    """
+    try:
+        with get_stripe_upstream().guard():
+            stripe.checkout.Session.expire(session_id)
+    except stripe.InvalidRequestError:
+        # No longer open: expired, or completed
+        with get_stripe_upstream().guard():
+            session = stripe.checkout.Session.retrieve(session_id)
+        if session.get('payment_status') == 'paid':
+            return session
+    return None
+
+
+
+def checkout_url(booking):
+    """Return a Stripe Checkout URL for booking.
+
+    The booking's last session is reused while it is still open for the same
+    amount, so repeat clicks don't call Stripe at all. If that session was
+    paid in the meantime, the booking is updated and the URL of the payment
+    success page is returned instead.
+    """
+    amount = int(round(booking.gig.price * 100))  # Amount in cents
+    if booking.checkout_session_id and booking.checkout_amount == amount \
+            and booking.checkout_expires_at and booking.checkout_expires_at > datetime.utcnow() + REUSE_MARGIN:
+        return booking.checkout_url
+
+    # checkout_expires_at is cleared once Stripe reports the session expired
+    if booking.checkout_session_id and booking.checkout_expires_at:
+        paid = _expire_session(booking.checkout_session_id)
+        if paid is not None:
+            apply_checkout_session(booking, paid)
+            db.session.commit()
+            return url_for('payment_success', booking_id=booking.id)
+
+    params = _checkout_params(booking, amount)
+    # Concurrent clicks (and the SDK's own retries) send the same key, so Stripe
+    # returns one session instead of creating several. The key changes with the
+    # session being replaced and with the parameters, which Stripe requires.
+    # checkout_session_id is kept after a session expires for this reason: a
+    # key Stripe still remembers would hand back the expired session.
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    key = f'checkout-{booking.id}-{booking.checkout_session_id or "new"}-{digest}'
+    with get_stripe_upstream().guard():
+        session = stripe.checkout.Session.create(idempotency_key=key, **params)
+
+    booking.checkout_session_id = session.id
+    booking.checkout_url = session.url
+    booking.checkout_amount = amount
+    booking.checkout_expires_at = datetime.utcfromtimestamp(session.expires_at)
+    db.session.commit()
+    return session.url
+
+
+
+def apply_checkout_session(booking, session, event_type=None):
+    """Update booking from a Checkout session object sent or returned by Stripe."""
+    if event_type == EXPIRED_EVENT:
+        if booking.checkout_session_id == session['id']:
+            booking.checkout_url = None
+            booking.checkout_amount = None
+            booking.checkout_expires_at = None
+        return
+    if session.get('payment_status') != 'paid':
+        return
+    if session['id'] != booking.checkout_session_id:
+        # Replaced sessions are expired first, but one can be paid before that
+        if booking.status == 'Accepted':
+            current_app.logger.warning(f'Booking {booking.id} was paid through replaced checkout session {session["id"]}')
+        else:
+            current_app.logger.error(f'Booking {booking.id} is already {booking.status}, but checkout session '
+                                     f'{session["id"]} was paid as well; refund it in Stripe')
+    if booking.status == 'Accepted' and booking.change_status('Accepted', 'Confirmed'):
+        record_status_change(booking, 'Accepted')
+        notify_booking(booking, booking.buyer_id, booking.gig.seller_id)
+
+
+
+def sync_checkout(booking):
+    """Ask Stripe for the state of the booking's session, for when there is no webhook."""
+    with get_stripe_upstream().guard():
+        session = stripe.checkout.Session.retrieve(booking.checkout_session_id)
+    apply_checkout_session(booking, session)
+    db.session.commit()
+
+
+
+@app.route('/stripe/webhook', methods=['POST'])
+def stripe_webhook():
+    secret = current_app.config['STRIPE_WEBHOOK_SECRET']
+    if not secret:
+        abort(404)
+    payload = request.get_data(as_text=True)
+    try:
+        stripe_event = stripe.Webhook.construct_event(payload, request.headers.get('Stripe-Signature', ''), secret)
+    except (ValueError, stripe.SignatureVerificationError):
+        return jsonify(error='Invalid payload or signature.'), 400
+    if stripe_event.type not in PAID_EVENTS and stripe_event.type != EXPIRED_EVENT:
+        return jsonify(received=True)
+
+    # Stored and acknowledged right away; the worker applies it. Stripe
+    # redelivers events, so a second copy of one is ignored.
+    db.session.add(StripeEvent(event_id=stripe_event.id, type=stripe_event.type, payload=payload))
+    db.session.info['stripe_event_queued'] = True
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+    return jsonify(received=True)
+
+
+
+def claim_batch(limit):
+    # Same lease scheme as the email outbox
+    token = uuid.uuid4().hex
+    now = datetime.utcnow()
+    lease = timedelta(seconds=current_app.config['STRIPE_EVENTS_LEASE'])
+    due = select(StripeEvent.id) \
+        .where(StripeEvent.status == 'Pending', StripeEvent.next_attempt_at <= now) \
+        .order_by(StripeEvent.next_attempt_at) \
+        .limit(limit)
+    db.session.execute(
+        update(StripeEvent)
+        .where(StripeEvent.id.in_(due), StripeEvent.status == 'Pending', StripeEvent.next_attempt_at <= now)
+        .values(claim_token=token, next_attempt_at=now + lease)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return StripeEvent.query.filter_by(claim_token=token).order_by(StripeEvent.id).all()
+
+
+
+def apply_event(stripe_event):
+    session = json.loads(stripe_event.payload)['data']['object']
+    booking_id = (session.get('metadata') or {}).get('booking_id') or session.get('client_reference_id')
+    booking = db.session.get(Booking, int(booking_id)) if booking_id else None
+    if booking is None:
+        current_app.logger.warning(f'Stripe event {stripe_event.event_id} is not for a known booking')
+        return
+    apply_checkout_session(booking, session, stripe_event.type)
+
+
+
+def process_batch(limit=50):
+    """Apply one batch of due webhook events. Returns how many were attempted."""
+    events = claim_batch(limit)
+    max_attempts = current_app.config['STRIPE_EVENTS_MAX_ATTEMPTS']
+    backoff = current_app.config['STRIPE_EVENTS_BACKOFF']
+    for stripe_event in events:
+        try:
+            apply_event(stripe_event)
+            error = None
+        except Exception as e:
+            db.session.rollback()
+            error = e
+        now = datetime.utcnow()
+        stripe_event.attempts += 1
+        stripe_event.claim_token = None
+        if error is None:
+            stripe_event.status = 'Processed'
+            stripe_event.processed_at = now
+            stripe_event.last_error = None
+        elif stripe_event.attempts >= max_attempts:
+            stripe_event.status = 'Failed'
+            stripe_event.last_error = str(error)
+            current_app.logger.error(f'Giving up on Stripe event {stripe_event.event_id}: {error}')
+        else:
+            delay = min(backoff * 2 ** (stripe_event.attempts - 1), MAX_BACKOFF) * random.uniform(1, 1.25)
+            stripe_event.next_attempt_at = now + timedelta(seconds=delay)
+            stripe_event.last_error = str(error)
+        db.session.commit()
+    return len(events)
+
+
+
+def run_worker(once=False):
+    """Apply webhook events until stopped, or until none are due if once is set."""
+    while not _stop.is_set():
+        processed = 0
+        try:
+            processed = process_batch()
+        except Exception:
+            current_app.logger.exception('Error processing Stripe events')
+            db.session.rollback()
+        if processed:
+            continue
+        if once:
+            break
+        _wake.wait(current_app.config['STRIPE_EVENTS_POLL_INTERVAL'])
+        _wake.clear()
+
+
+
+def _run_in_app(flask_app):
+    with flask_app.app_context():
+        run_worker()
+
+
+
+def start_worker(flask_app):
+    global _worker_pid, _worker_thread
+    if _worker_pid == os.getpid():
+        return
+    with _lock:
+        if _worker_pid == os.getpid():
+            return
+        _worker_pid = os.getpid()
+        _stop.clear()
+        _worker_thread = threading.Thread(target=_run_in_app, args=(flask_app,), name='stripe-events', daemon=True)
+        _worker_thread.start()
+
+
+
+@atexit.register
+def stop_worker():
+    _stop.set()
+    _wake.set()
+    if _worker_thread is not None and _worker_pid == os.getpid():
+        _worker_thread.join(timeout=app.config['OUTBOUND_READ_TIMEOUT'])
+
+
+
+@app.before_request
+def start_stripe_event_worker():
+    if app.config['STRIPE_EVENTS_IN_PROCESS'] and app.config['STRIPE_WEBHOOK_SECRET']:
+        start_worker(app)
+
+
+
+@event.listens_for(db.session, 'after_commit')
+def wake_stripe_event_worker(session):
+    if session.info.pop('stripe_event_queued', False):
+        _wake.set()
+
+
+
+@event.listens_for(db.session, 'after_rollback')
+def clear_stripe_event_flag(session):
+    if session.in_nested_transaction():
+        return
+    session.info.pop('stripe_event_queued', None)
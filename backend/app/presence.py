@@ -0,0 +1,99 @@
+import atexit
+import os
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, or_
+from app import app, db
+from app.models import User
+
+
+_lock = threading.Lock()
+_stop = threading.Event()
+_pending = {}
+_last_written = {}
+_flusher_pid = None
+
+
+
+def touch(user_id):
+    """Record that a user was seen now. Written to the database later by flush()."""
+    now = datetime.utcnow()
+    granularity = timedelta(seconds=app.config['LAST_SEEN_GRANULARITY'])
+    with _lock:
+        last = _pending.get(user_id) or _last_written.get(user_id)
+        if last is not None and now - last < granularity:
+            return
+        _pending[user_id] = now
+
+
+
+def flush():
+    """Write buffered last_seen values in one batched UPDATE."""
+    with _lock:
+        if not _pending:
+            return 0
+        batch = dict(_pending)
+        _pending.clear()
+
+    user = User.__table__
+    statement = user.update() \
+        .where(user.c.id == bindparam('b_id')) \
+        .where(or_(user.c.last_seen.is_(None), user.c.last_seen < bindparam('b_last_seen'))) \
+        .values(last_seen=bindparam('b_last_seen'))
+    try:
+        db.session.execute(statement, [
+            {'b_id': user_id, 'b_last_seen': seen} for user_id, seen in batch.items()
+        ])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        # Put the batch back unless newer values arrived meanwhile
+        with _lock:
+            for user_id, seen in batch.items():
+                _pending.setdefault(user_id, seen)
+        raise
+
+    with _lock:
+        _last_written.update(batch)
+        # Only the granularity window matters for skipping writes
+        cutoff = datetime.utcnow() - timedelta(seconds=app.config['LAST_SEEN_GRANULARITY'])
+        for user_id in [u for u, seen in _last_written.items() if seen < cutoff]:
+            del _last_written[user_id]
+    return len(batch)
+
+
+
+def _run_flusher():
+    with app.app_context():
+        while not _stop.wait(app.config['LAST_SEEN_FLUSH_INTERVAL']):
+            try:
+                flush()
+            except Exception:
+                app.logger.exception('Error flushing last_seen updates')
+
+
+
+def start_flusher():
+    global _flusher_pid
+    if _flusher_pid == os.getpid():
+        return
+    with _lock:
+        if _flusher_pid == os.getpid():
+            return
+        _flusher_pid = os.getpid()
+        # A forked process must not write back the parent's buffer
+        _pending.clear()
+        _last_written.clear()
+        threading.Thread(target=_run_flusher, name='last-seen-flusher', daemon=True).start()
+
+
+
+@atexit.register
+def flush_on_shutdown():
+    _stop.set()
+    if _pending:
+        with app.app_context():
+            try:
+                flush()
+            except Exception:
+                app.logger.exception('Error flushing last_seen updates on shutdown')
@@ -0,0 +1,19 @@
+from flask_sqlalchemy.session import Session
+
+
+
+class RoutingSession(Session):
+    """Reads from a replica when the request picked one; writes go to the primary.
+
+    The first flush or DML statement switches the rest of the session to the
+    primary as well, so a request always reads its own writes.
+    """
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self.info.get('replica')
+        if replica is not None and bind is None:
+            if not self._flushing and not getattr(clause, 'is_dml', False):
+                return replica
+            del self.info['replica']
+        if bind is None and (self._flushing or getattr(clause, 'is_dml', False)):
+            self.info['wrote'] = True
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
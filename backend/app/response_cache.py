@@ -0,0 +1,122 @@
+import hashlib
+from datetime import datetime, timezone
+from functools import wraps
+from flask import request, session, make_response
+from flask_login import current_user
+from sqlalchemy import event
+from app import app, db
+from app.database import use_primary
+from app.lru import LRUCache
+from app.models import Gig, Review, Booking
+from app.versions import get_version, bump_version
+
+
+ALL_GIGS = 'gigs'
+
+_cache = None
+
+
+
+def gig_tag(gig_id):
+    return f'gig:{gig_id}'
+
+
+
+def _get_cache():
+    global _cache
+    if _cache is None:
+        _cache = LRUCache(app.config['RESPONSE_CACHE_SIZE'])
+    return _cache
+
+
+
+def _cache_key():
+    # Drop empty args so ?keyword=&location=x and ?location=x share an entry
+    args = tuple(sorted((k, v) for k, v in request.args.items(multi=True) if v))
+    return request.endpoint, tuple(sorted(request.view_args.items())), args
+
+
+
+def _conditional(body, mimetype, etag, last_modified):
+    response = make_response(body)
+    response.mimetype = mimetype
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+
+def cached_response(tags):
+    """Cache a public page for anonymous GETs and answer conditional GETs.
+
+    tags(**view_args) names the version stamps the page depends on; bumping
+    any of them (see invalidate_gig) makes every worker re-render it.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Logged-in pages show per-user navigation and flashed messages
+            if request.method != 'GET' or current_user.is_authenticated or '_flashes' in session:
+                return view(*args, **kwargs)
+
+            key = _cache_key()
+            versions = tuple(get_version(tag) for tag in tags(**kwargs))
+            entry = _get_cache().get(key)
+            if entry is not None and entry[0] == versions:
+                return _conditional(*entry[1:])
+
+            # Every visitor gets this copy, so don't render it from a lagging replica
+            use_primary()
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200 or session.modified:
+                return response
+            body = response.get_data()
+            etag = hashlib.sha1(body).hexdigest()
+            last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+            entry = (versions, body, response.mimetype, etag, last_modified)
+            _get_cache().set(key, entry, app.config['RESPONSE_CACHE_TTL'])
+            return _conditional(*entry[1:])
+        return wrapper
+    return decorator
+
+
+
+def invalidate_gig(gig_id=None):
+    """Mark cached pages for one gig, and every gig listing, as stale."""
+    bump_version(ALL_GIGS)
+    if gig_id is not None:
+        bump_version(gig_tag(gig_id))
+
+
+
+@event.listens_for(db.session, 'after_flush')
+def _collect_changed_gigs(session, flush_context):
+    # Gig rows show up in listings; reviews and bookings only on their gig's page
+    changed = session.info.setdefault('changed_gigs', {})
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Gig):
+            changed[obj.id] = True
+        elif isinstance(obj, (Review, Booking)) and obj.gig_id is not None:
+            changed.setdefault(obj.gig_id, False)
+
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_changed_gigs(session):
+    changed = session.info.pop('changed_gigs', None)
+    if not changed:
+        return
+    if any(changed.values()):
+        bump_version(ALL_GIGS)
+    for gig_id in changed:
+        bump_version(gig_tag(gig_id))
+
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _discard_changed_gigs(session):
+    if session.in_nested_transaction():
+        return
+    session.info.pop('changed_gigs', None)
@@ -1,16 +1,25 @@
-from flask import render_template, flash, redirect, url_for, request, current_app
+from datetime import date
+from flask import render_template, flash, redirect, url_for, request, current_app, jsonify, abort
 from flask_login import login_user, current_user, logout_user, login_required
+from sqlalchemy.orm import joinedload, selectinload, contains_eager
 from app import app, db
 from app.forms import RegistrationForm, LoginForm, EditProfileForm, GigForm, CategoryForm, MessageForm, ReviewForm, SearchForm, BookingForm, EmptyForm
-from app.models import User, Gig, Category, Message, Review, Booking
+from app.models import User, Gig, Category, Message, Conversation, Review, Booking
 from werkzeug.urls import url_parse
-from datetime import datetime
-import os
-from PIL import Image
 import stripe
-import requests
-from math import radians, cos, sin, asin, sqrt
-from app.email import send_email
+from app.email import queue_email
+from app.geocoding import geocode
+from app.search import find_gigs
+from app.pagination import keyset_paginate, keyset_paginate_union, Page
+from app.presence import touch, start_flusher
+from app.images import save_profile_picture, ImageRejected
+from app.outbound import CircuitOpenError
+from app.payments import checkout_url, sync_checkout
+from app.availability import DURATIONS, SlotTaken, book, free_slots, lock_calendar
+from app.seller_stats import record_status_change, record_review, daily_stats
+from app.notifications import notify_message, notify_booking
+from app.response_cache import cached_response, gig_tag, ALL_GIGS
+from app.categories import get_category, get_category_by_name, invalidate_categories
 
 
 
@@ -19,8 +28,9 @@ from app.email import send_email
 @app.before_request
 def before_request():
     if current_user.is_authenticated:
-        current_user.last_seen = datetime.utcnow()
-        db.session.commit()
+        # Buffered and written in batches, so this request stays read-only
+        start_flusher()
+        touch(current_user.id)
 
 
 
@@ -32,6 +42,7 @@ def inject_google_maps_key():
 
 @app.route('/')
 @app.route('/index')
+@cached_response(lambda: [])
 def index():
     return render_template('index.html', title='Home')
 
@@ -40,7 +51,16 @@ def index():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    return render_template('dashboard.html', title='Dashboard')
+    # One range read of the seller's precomputed daily rows
+    days = daily_stats(current_user.id, current_app.config['DASHBOARD_DAYS'])
+    totals = {name: sum(getattr(day, name) for day in days)
+              for name in ('requested', 'pending', 'accepted', 'declined', 'confirmed', 'completed',
+                           'revenue', 'review_count', 'rating_sum')}
+    paid = totals['confirmed'] + totals['completed']
+    conversion = paid / totals['requested'] if totals['requested'] else None
+    average_rating = totals['rating_sum'] / totals['review_count'] if totals['review_count'] else None
+    return render_template('dashboard.html', title='Dashboard', days=days, totals=totals,
+                           conversion=conversion, average_rating=average_rating)
 
 
 
@@ -86,33 +106,16 @@ def logout():
 
 
 
-@app.route('/user/<username>', methods=['GET', 'POST'])
+@app.route('/user/<username>')
 @login_required
 def user(username):
     user = User.query.filter_by(username=username).first_or_404()
     form = MessageForm()
-    if form.validate_on_submit():
-        # Handle form submission (e.g., send a message)
-        flash('Your message has been sent!')
-        return redirect(url_for('user', username=user.username))
-    return render_template('user.html', user=user, form=form)
-
+    gigs = keyset_paginate(user.gigs.options(joinedload(Gig.category)),
+                           [(Gig.timestamp, True), (Gig.id, True)], request.args.get('cursor'))
+    return render_template('user.html', user=user, gigs=gigs, form=form)
 
 
-def save_picture(form_picture):
-    random_hex = os.urandom(8).hex()
-    _, f_ext = os.path.splitext(form_picture.filename)
-    picture_fn = random_hex + f_ext
-    picture_path = os.path.join(app.root_path, 'static/profile_pics', picture_fn)
-    
-    # Resize the image
-    output_size = (125, 125)
-    i = Image.open(form_picture)
-    i.thumbnail(output_size)
-    i.save(picture_path)
-
-    return picture_fn
-
 
 @app.route('/edit_profile', methods=['GET', 'POST'])
 @login_required
@@ -120,8 +123,12 @@ def edit_profile():
     form = EditProfileForm()
     if form.validate_on_submit():
         if form.profile_picture.data:
-            picture_file = save_picture(form.profile_picture.data)
-            current_user.profile_image = picture_file
+            try:
+                if not save_profile_picture(current_user, form.profile_picture.data):
+                    flash('Your new profile picture will appear shortly.')
+            except ImageRejected as e:
+                flash(str(e))
+                return render_template('edit_profile.html', title='Edit Profile', form=form)
         current_user.username = form.username.data
         current_user.about_me = form.about_me.data
         db.session.commit()
@@ -141,23 +148,17 @@ def create_gig():
     if form.validate_on_submit():
         # Geocode the location
         address = form.location.data
-        api_key = current_app.config['GOOGLE_MAPS_API_KEY']
-        geocode_url = f'https://maps.googleapis.com/maps/api/geocode/json?address={address}&key={api_key}'
-        response = requests.get(geocode_url)
-        data = response.json()
-        if data['status'] == 'OK':
-            location_data = data['results'][0]['geometry']['location']
-            latitude = location_data['lat']
-            longitude = location_data['lng']
-        else:
+        coordinates = geocode(address)
+        if coordinates is None:
             flash('Could not geocode the provided address.')
             return render_template('create_gig.html', title='Create Gig', form=form)
+        latitude, longitude = coordinates
 
         gig = Gig(
             title=form.title.data,
             description=form.description.data,
             price=form.price.data,
-            category=form.category.data,
+            category_id=form.category.data.id,
             location=address,
             latitude=latitude,
             longitude=longitude,
@@ -173,8 +174,13 @@ def create_gig():
 
 
 @app.route('/gig/<int:gig_id>', methods=['GET', 'POST'])
+@cached_response(lambda gig_id: [gig_tag(gig_id)])
 def gig_detail(gig_id):
-    gig = Gig.query.get_or_404(gig_id)
+    gig = Gig.query.options(
+        joinedload(Gig.category),
+        joinedload(Gig.seller),
+        selectinload(Gig.reviews).joinedload(Review.user)
+    ).get_or_404(gig_id)
     form = EmptyForm()
     return render_template('gig_detail.html', gig=gig, form=form)
 
@@ -191,7 +197,7 @@ def edit_gig(gig_id):
     if form.validate_on_submit():
         gig.title = form.title.data
         gig.description = form.description.data
-        gig.category = form.category.data
+        gig.category_id = form.category.data.id
         gig.price = float(form.price.data)
         gig.location = form.location.data
         gig.travel_radius = float(form.travel_radius.data)
@@ -201,7 +207,7 @@ def edit_gig(gig_id):
     elif request.method == 'GET':
         form.title.data = gig.title
         form.description.data = gig.description
-        form.category.data = gig.category
+        form.category.data = get_category(gig.category_id)
         form.price.data = str(gig.price)
         form.location.data = gig.location
         form.travel_radius.data = str(gig.travel_radius)
@@ -228,13 +234,14 @@ def delete_gig(gig_id):
 def add_category():
     form = CategoryForm()
     if form.validate_on_submit():
-        existing_category = Category.query.filter_by(name=form.name.data).first()
+        existing_category = get_category_by_name(form.name.data)
         if existing_category:
             flash('Category already exists.')
             return redirect(url_for('create_gig'))
         category = Category(name=form.name.data)
         db.session.add(category)
         db.session.commit()
+        invalidate_categories()
         flash('New category added.')
         return redirect(url_for('create_gig'))
     return render_template('add_category.html', title='Add Category', form=form)
@@ -247,17 +254,20 @@ def send_message(username):
     user = User.query.filter_by(username=username).first_or_404()
     form = MessageForm()
     if form.validate_on_submit():
+        conversation = Conversation.between(current_user, user)
         msg = Message(sender=current_user, recipient=user, body=form.message.data)
+        conversation.add_message(msg)
         db.session.add(msg)
-        db.session.commit()
+        notify_message(msg)
 
-        # Send email notification to the recipient
+        # Email notification to the recipient goes out with the message
         subject = f'New message from {current_user.username}'
         html_content = render_template('email/new_message.html', user=user, message=msg)
-        send_email(user.email, subject, html_content)
+        queue_email(user.email, subject, html_content)
+        db.session.commit()
 
         flash('Your message has been sent.')
-        return redirect(url_for('user', username=username))
+        return redirect(url_for('conversation', username=username))
     return render_template('send_message.html', form=form, recipient=user)
 
 
@@ -265,8 +275,34 @@ def send_message(username):
 @app.route('/messages')
 @login_required
 def messages():
-    messages = current_user.received_messages.order_by(Message.timestamp.desc()).all()
-    return render_template('messages.html', messages=messages)
+    conversations = keyset_paginate_union(
+        Conversation.query.options(
+            joinedload(Conversation.user_a).load_only(User.username, User.profile_image),
+            joinedload(Conversation.user_b).load_only(User.username, User.profile_image),
+        ),
+        Conversation.sides(current_user),
+        [(Conversation.last_message_at, True), (Conversation.id, True)],
+        request.args.get('cursor'))
+    return render_template('messages.html', conversations=conversations)
+
+
+
+@app.route('/messages/<username>')
+@login_required
+def conversation(username):
+    other = User.query.filter_by(username=username).first_or_404()
+    user_a_id, user_b_id = Conversation.pair(current_user.id, other.id)
+    conversation = Conversation.query.filter_by(user_a_id=user_a_id, user_b_id=user_b_id).first()
+    if conversation is None:
+        messages = Page([], None, None)
+    else:
+        if conversation.unread_for(current_user):
+            conversation.mark_read(current_user)
+            db.session.commit()
+        # Newest first, so the next page holds older messages
+        messages = keyset_paginate(conversation.messages, [(Message.timestamp, True), (Message.id, True)],
+                                   request.args.get('cursor'))
+    return render_template('conversation.html', other=other, messages=messages, form=MessageForm())
 
 
 
@@ -276,13 +312,11 @@ def book_gig(gig_id):
     gig = Gig.query.get_or_404(gig_id)
     form = BookingForm()
     if form.validate_on_submit():
-        booking = Booking(
-            gig=gig,
-            buyer=current_user,
-            booking_date=form.booking_date.data,
-            status='Pending'
-        )
-        db.session.add(booking)
+        try:
+            booking = book(gig, current_user, form.booking_date.data, form.duration.data)
+        except SlotTaken:
+            form.booking_date.errors.append('The seller is already booked then. Please pick another time.')
+            return render_template('book_gig.html', title='Book Gig', form=form, gig=gig), 409
         db.session.commit()
         flash('Your booking request has been sent!')
         return redirect(url_for('booking_detail', booking_id=booking.id))
@@ -290,11 +324,36 @@ def book_gig(gig_id):
 
 
 
+@app.route('/gig/<int:gig_id>/availability')
+@login_required
+def gig_availability(gig_id):
+    """Free start times for a booking of ?duration= minutes over ?days= days from ?start=."""
+    gig = Gig.query.get_or_404(gig_id)
+    duration = request.args.get('duration', 60, type=int)
+    days = request.args.get('days', 7, type=int)
+    try:
+        start = date.fromisoformat(request.args['start']) if 'start' in request.args else date.today()
+    except ValueError:
+        abort(400)
+    if duration not in dict(DURATIONS) or not 1 <= days <= current_app.config['AVAILABILITY_MAX_DAYS']:
+        abort(400)
+    slots = free_slots(gig.seller_id, start, days, duration)
+    return jsonify(duration=duration, days=[
+        {'date': day.isoformat(), 'slots': [slot.strftime('%H:%M') for slot in day_slots]}
+        for day, day_slots in slots
+    ])
+
+
+
 @app.route('/booking/<int:booking_id>')
 @login_required
 def booking_detail(booking_id):
     form = EmptyForm()
-    booking = Booking.query.get_or_404(booking_id)
+    booking = Booking.query.options(
+        joinedload(Booking.gig).joinedload(Gig.seller),
+        joinedload(Booking.buyer),
+        joinedload(Booking.review)
+    ).get_or_404(booking_id)
     if booking.buyer != current_user and booking.gig.seller != current_user:
         flash('You are not authorized to view this booking.')
         return redirect(url_for('index'))
@@ -305,7 +364,7 @@ def booking_detail(booking_id):
 @app.route('/booking/<int:booking_id>/update_status', methods=['POST'])
 @login_required
 def update_booking_status(booking_id):
-    booking = Booking.query.get_or_404(booking_id)
+    booking = Booking.query.options(joinedload(Booking.gig).joinedload(Gig.seller), joinedload(Booking.buyer)).get_or_404(booking_id)
     if booking.gig.seller != current_user:
         flash('You are not authorized to update this booking.')
         return redirect(url_for('index'))
@@ -314,16 +373,18 @@ def update_booking_status(booking_id):
         flash('You can only update pending bookings.')
         return redirect(url_for('booking_detail', booking_id=booking.id))
 
-    action = request.form.get('action')
-    if action == 'Accept':
-        booking.status = 'Accepted'
-        # Send email to buyer
-        subject = 'Your booking has been accepted!'
-        html_content = render_template('email/booking_accepted.html', booking=booking)
-        send_email(booking.buyer.email, subject, html_content)
-    elif action == 'Decline':
-        booking.status = 'Declined'
-        # Notify buyer that booking has been declined
+    new_status = {'Accept': 'Accepted', 'Decline': 'Declined'}.get(request.form.get('action'))
+    if new_status == 'Declined':
+        lock_calendar(booking.seller_id)
+    # A double-click sends two requests; only the one that changed the row goes on
+    if new_status and booking.change_status('Pending', new_status):
+        if new_status == 'Accepted':
+            # Email the buyer along with the status change
+            subject = 'Your booking has been accepted!'
+            html_content = render_template('email/booking_accepted.html', booking=booking)
+            queue_email(booking.buyer.email, subject, html_content)
+        record_status_change(booking, 'Pending')
+        notify_booking(booking, booking.buyer_id)
     db.session.commit()
     flash(f'Booking has been {booking.status.lower()}.')
     return redirect(url_for('booking_detail', booking_id=booking.id))
@@ -337,83 +398,35 @@ def search():
         keyword = form.keyword.data
         category = form.category.data
         location = form.location.data
-        return redirect(url_for('search_results', keyword=keyword, category_id=category.id if category else None, location=location))
+        radius = form.radius.data
+        return redirect(url_for('search_results', keyword=keyword, category_id=category.id if category else None, location=location, radius=radius))
     return render_template('search.html', title='Search Gigs', form=form)
 
 
 
-def haversine(lon1, lat1, lon2, lat2):
-    # Calculate the great circle distance between two points
-    # on the earth (specified in decimal degrees)
-    # Convert decimal degrees to radians
-    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
-    # Haversine formula
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = sin(dlat / 2)**2 + cos(lat1) * cos(lat2) * sin(dlon / 2)**2
-    c = 2 * asin(sqrt(a))
-    km = 6371 * c  # Radius of earth in kilometers
-    return km
-
-
-
 @app.route('/search_results')
+@cached_response(lambda: [ALL_GIGS])
 def search_results():
     keyword = request.args.get('keyword', '')
     category_id = request.args.get('category_id', type=int)
     location = request.args.get('location', '')
     radius = request.args.get('radius', type=int)
+    cursor = request.args.get('cursor')
 
-    query = Gig.query
+    gigs = find_gigs(Gig.query.options(joinedload(Gig.category)), keyword, category_id, location, radius, cursor)
+    if gigs is None:
+        flash('Could not geocode the provided location.')
+        gigs = Page([], cursor, None)
 
-    # Filter by keyword
-    if keyword:
-        query = query.filter(
-            Gig.title.ilike(f'%{keyword}%') |
-            Gig.description.ilike(f'%{keyword}%')
-        )
-
-    # Filter by category
-    if category_id:
-        query = query.filter_by(category_id=category_id)
-
-    gigs = query.all()
-
-    # Filter by proximity
-    if location and radius:
-        # Geocode user's location
-        address = location
-        api_key = current_app.config['GOOGLE_MAPS_API_KEY']
-        geocode_url = f'https://maps.googleapis.com/maps/api/geocode/json?address={address}&key={api_key}'
-        response = requests.get(geocode_url)
-        data = response.json()
-        if data['status'] == 'OK':
-            user_location = data['results'][0]['geometry']['location']
-            user_lat = user_location['lat']
-            user_lon = user_location['lng']
-
-            # Filter gigs within radius
-            nearby_gigs = []
-            for gig in gigs:
-                if gig.latitude and gig.longitude:
-                    distance = haversine(user_lon, user_lat, gig.longitude, gig.latitude)
-                    if distance <= radius:
-                        nearby_gigs.append(gig)
-            gigs = nearby_gigs
-        else:
-            flash('Could not geocode the provided location.')
-            gigs = []
-    else:
-        gigs = query.all()
-
-    return render_template('search_results.html', gigs=gigs, keyword=keyword, location=location)
+    return render_template('search_results.html', gigs=gigs, keyword=keyword, location=location,
+                           category_id=category_id, radius=radius)
 
 
 
 @app.route('/review/<int:booking_id>', methods=['GET', 'POST'])
 @login_required
 def review(booking_id):
-    booking = Booking.query.get_or_404(booking_id)
+    booking = Booking.query.options(joinedload(Booking.gig), joinedload(Booking.review)).get_or_404(booking_id)
     if booking.buyer != current_user:
         flash('You are not authorized to review this gig.')
         return redirect(url_for('index'))
@@ -436,6 +449,8 @@ def review(booking_id):
             comment=form.comment.data
         )
         db.session.add(review)
+        booking.gig.add_rating(review.rating)
+        record_review(review)
         db.session.commit()
         flash('Your review has been submitted.')
         return redirect(url_for('gig_detail', gig_id=booking.gig_id))
@@ -446,7 +461,7 @@ def review(booking_id):
 @app.route('/complete_booking/<int:booking_id>', methods=['POST'])
 @login_required
 def complete_booking(booking_id):
-    booking = Booking.query.get_or_404(booking_id)
+    booking = Booking.query.options(joinedload(Booking.gig).joinedload(Gig.seller)).get_or_404(booking_id)
     if booking.gig.seller != current_user:
         flash('You are not authorized to complete this booking.')
         return redirect(url_for('index'))
@@ -455,10 +470,11 @@ def complete_booking(booking_id):
         flash('Only confirmed bookings can be marked as completed.')
         return redirect(url_for('booking_detail', booking_id=booking.id))
 
-    booking.status = 'Completed'
+    if booking.change_status('Confirmed', 'Completed'):
+        record_status_change(booking, 'Confirmed')
+        notify_booking(booking, booking.buyer_id)
     db.session.commit()
     flash('Booking marked as completed.')
-    # Notify buyer that booking is completed
     return redirect(url_for('booking_detail', booking_id=booking.id))
 
 
@@ -466,7 +482,7 @@ def complete_booking(booking_id):
 @app.route('/my_gigs')
 @login_required
 def my_gigs():
-    gigs = current_user.gigs.order_by(Gig.timestamp.desc()).all()
+    gigs = keyset_paginate(current_user.gigs, [(Gig.timestamp, True), (Gig.id, True)], request.args.get('cursor'))
     return render_template('my_gigs.html', gigs=gigs)
 
 
@@ -474,7 +490,10 @@ def my_gigs():
 @app.route('/my_bookings')
 @login_required
 def my_bookings():
-    bookings = Booking.query.filter_by(buyer_id=current_user.id).order_by(Booking.timestamp.desc()).all()
+    query = Booking.query.filter_by(buyer_id=current_user.id).options(joinedload(Booking.gig))
+    bookings = keyset_paginate(query,
+                               [(Booking.timestamp, True), (Booking.id, True)],
+                               request.args.get('cursor'))
     return render_template('my_bookings.html', bookings=bookings)
 
 
@@ -482,8 +501,11 @@ def my_bookings():
 @app.route('/bookings_for_my_gigs')
 @login_required
 def bookings_for_my_gigs():
-    gigs = current_user.gigs.all()
-    bookings = Booking.query.filter(Booking.gig_id.in_([gig.id for gig in gigs])).order_by(Booking.timestamp.desc()).all()
+    # Booking.seller_id rather than a join through gig, so the page is read
+    # off ix_booking_seller_id_timestamp in order
+    query = Booking.query.join(Gig).filter(Booking.seller_id == current_user.id) \
+        .options(contains_eager(Booking.gig), joinedload(Booking.buyer))
+    bookings = keyset_paginate(query, [(Booking.timestamp, True), (Booking.id, True)], request.args.get('cursor'))
     return render_template('bookings_for_my_gigs.html', bookings=bookings)
 
 
@@ -491,7 +513,7 @@ def bookings_for_my_gigs():
 @app.route('/create-checkout-session/<int:booking_id>', methods=['POST'])
 @login_required
 def create_checkout_session(booking_id):
-    booking = Booking.query.get_or_404(booking_id)
+    booking = Booking.query.options(joinedload(Booking.gig)).get_or_404(booking_id)
     if booking.buyer != current_user:
         flash('You are not authorized to make this payment.')
         return redirect(url_for('index'))
@@ -500,24 +522,13 @@ def create_checkout_session(booking_id):
         flash('Payment can only be made for accepted bookings.')
         return redirect(url_for('booking_detail', booking_id=booking.id))
     
-    session = stripe.checkout.Session.create(
-        payment_method_types=['card'],
-        line_items=[{
-            'price_data': {
-                'currency': 'usd',
-                'unit_amount': int(booking.gig.price * 100),  # Amount in cents
-                'product_data': {
-                    'name': booking.gig.title,
-                    'description': booking.gig.description,
-                },
-            },
-            'quantity': 1,
-        }],
-        mode='payment',
-        success_url=url_for('payment_success', booking_id=booking.id, _external=True),
-        cancel_url=url_for('booking_detail', booking_id=booking.id, _external=True),
-    )
-    return redirect(session.url, code=303)
+    try:
+        url = checkout_url(booking)
+    except (stripe.StripeError, CircuitOpenError) as e:
+        current_app.logger.error(f'Error creating checkout session: {e}')
+        flash('Payment is temporarily unavailable. Please try again shortly.')
+        return redirect(url_for('booking_detail', booking_id=booking.id))
+    return redirect(url, code=303)
 
 
 
@@ -529,10 +540,18 @@ def payment_success(booking_id):
         flash('You are not authorized to access this page.')
         return redirect(url_for('index'))
 
-    booking.status = 'Confirmed'
-    db.session.commit()
-    flash('Payment successful! Your booking is confirmed.')
-    # Notify seller that booking has been confirmed
+    # The redirect alone proves nothing: bookings are confirmed from Stripe's
+    # webhook, or by asking Stripe when no webhook is configured
+    if booking.status == 'Accepted' and booking.checkout_session_id \
+            and not current_app.config['STRIPE_WEBHOOK_SECRET']:
+        try:
+            sync_checkout(booking)
+        except (stripe.StripeError, CircuitOpenError) as e:
+            current_app.logger.error(f'Error checking checkout session: {e}')
+    if booking.status == 'Accepted':
+        flash('Thanks! Your payment is being processed and your booking will be confirmed shortly.')
+    else:
+        flash('Payment successful! Your booking is confirmed.')
     return redirect(url_for('booking_detail', booking_id=booking.id))
 
 
@@ -0,0 +1,147 @@
+import re
+from sqlalchemy import func, literal_column, table, column, text
+from app import db
+from app.models import Gig
+from app.geo import within_bounding_box, gigs_within_radius
+from app.geocoding import geocode
+from app.pagination import keyset_paginate
+
+
+FTS_TABLE = 'gig_fts'
+
+# SQLite: external-content FTS5 table over gig, kept in sync by triggers so
+# every insert/update/delete of a gig (ORM or core) updates the index.
+SQLITE_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        title, description, content='gig', content_rowid='id',
+        tokenize='porter unicode61')""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON gig BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON gig BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF title, description ON gig BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO {FTS_TABLE}(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END""",
+]
+
+SQLITE_DROP = [
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_au',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ad',
+    f'DROP TRIGGER IF EXISTS {FTS_TABLE}_ai',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+# Postgres: the tsvector is computed from the row, so an expression index is
+# always in sync and only needs to match the expression used in queries.
+POSTGRES_DDL = [
+    f"""CREATE INDEX IF NOT EXISTS ix_{FTS_TABLE} ON gig
+        USING gin (to_tsvector('english'::regconfig, title || ' ' || description))""",
+]
+
+POSTGRES_DROP = [
+    f'DROP INDEX IF EXISTS ix_{FTS_TABLE}',
+]
+
+fts = table(FTS_TABLE, column('rowid'), column('rank'))
+
+
+
+def _terms(keyword):
+    return re.findall(r'\w+', keyword.lower())
+
+
+
+def create_search_index(connection):
+    name = connection.dialect.name
+    statements = SQLITE_DDL if name == 'sqlite' else POSTGRES_DDL if name == 'postgresql' else []
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+
+def drop_search_index(connection):
+    name = connection.dialect.name
+    statements = SQLITE_DROP if name == 'sqlite' else POSTGRES_DROP if name == 'postgresql' else []
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+
+def rebuild_search_index():
+    connection = db.session.connection()
+    create_search_index(connection)
+    if connection.dialect.name == 'sqlite':
+        connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    elif connection.dialect.name == 'postgresql':
+        connection.execute(text(f'REINDEX INDEX ix_{FTS_TABLE}'))
+    db.session.commit()
+
+
+
+def search_gigs(query, keyword):
+    """Restrict a Gig query to rows matching keyword.
+
+    Returns (query, rank) where rank is an expression that sorts best
+    matches first in ascending order, or None if no ranking is available.
+    """
+    terms = _terms(keyword)
+    if not terms:
+        return query, None
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        # Each term is a quoted prefix match, all terms must appear
+        match = ' '.join(f'"{term}"*' for term in terms)
+        query = query.join(fts, fts.c.rowid == Gig.id) \
+            .filter(literal_column(FTS_TABLE).op('MATCH')(match))
+        return query, fts.c.rank
+
+    if dialect == 'postgresql':
+        document = func.to_tsvector(literal_column("'english'::regconfig"), Gig.title + ' ' + Gig.description)
+        tsquery = func.to_tsquery(literal_column("'english'::regconfig"), ' & '.join(f'{term}:*' for term in terms))
+        return query.filter(document.op('@@')(tsquery)), -func.ts_rank(document, tsquery)
+
+    query = query.filter(
+        Gig.title.ilike(f'%{keyword}%') |
+        Gig.description.ilike(f'%{keyword}%')
+    )
+    return query, None
+
+
+
+def find_gigs(query, keyword='', category_id=None, location='', radius=None, cursor=None):
+    """One page of gigs from query matching the search filters.
+
+    Best matches come first when there is a keyword, newest gigs otherwise.
+    Returns None if location can't be geocoded.
+    """
+    rank = None
+    if keyword:
+        query, rank = search_gigs(query, keyword)
+
+    if category_id:
+        query = query.filter(Gig.category_id == category_id)
+
+    if rank is not None:
+        order_by = [(rank, False), (Gig.id, False)]
+    else:
+        order_by = [(Gig.timestamp, True), (Gig.id, True)]
+
+    if not (location and radius):
+        return keyset_paginate(query, order_by, cursor)
+
+    coordinates = geocode(location)
+    if coordinates is None:
+        return None
+    latitude, longitude = coordinates
+    # Bounding box in SQL, exact distance only on the survivors
+    query = within_bounding_box(query, latitude, longitude, radius)
+    return keyset_paginate(query, order_by, cursor,
+                           filter_fn=lambda page: gigs_within_radius(page, latitude, longitude, radius))
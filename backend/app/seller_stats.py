@@ -0,0 +1,135 @@
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import case, func, insert, update
+from sqlalchemy.exc import IntegrityError
+from app import db
+from app.models import Booking, Gig, Review, SellerDailyStats
+
+
+# Booking status -> its SellerDailyStats counter
+STATUS_COLUMNS = {
+    'Pending': 'pending',
+    'Accepted': 'accepted',
+    'Declined': 'declined',
+    'Confirmed': 'confirmed',
+    'Completed': 'completed',
+}
+PAID_STATUSES = ('Confirmed', 'Completed')
+COUNTERS = ['requested', *STATUS_COLUMNS.values(), 'revenue', 'review_count', 'rating_sum']
+
+
+
+def _increment(seller_id, day, **amounts):
+    table = SellerDailyStats.__table__
+    amounts = {name: amount for name, amount in amounts.items() if amount}
+    if not amounts:
+        return
+    # Add in SQL, like the gig rating aggregates, so concurrent changes add up
+    result = db.session.execute(
+        update(table)
+        .where(table.c.seller_id == seller_id, table.c.day == day)
+        .values({name: table.c[name] + amount for name, amount in amounts.items()})
+    )
+    if result.rowcount:
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(table).values(seller_id=seller_id, day=day, **amounts))
+    except IntegrityError:
+        # Another request created the day's row first
+        _increment(seller_id, day, **amounts)
+
+
+
+def _amount(booking):
+    # What the buyer was charged, or the gig's price for bookings paid some other way
+    if booking.checkout_amount is not None:
+        return booking.checkout_amount
+    return int(round(booking.gig.price * 100))
+
+
+
+def record_booking(booking):
+    """Count a new booking, before the session is committed."""
+    if booking.timestamp is None:
+        booking.timestamp = datetime.utcnow()
+    _increment(booking.seller_id, booking.timestamp.date(), requested=1, pending=1)
+
+
+
+def record_status_change(booking, old_status):
+    """Move booking from old_status's counter to its current status's."""
+    if booking.status == old_status:
+        return
+    amounts = defaultdict(int)
+    amounts[STATUS_COLUMNS[old_status]] -= 1
+    amounts[STATUS_COLUMNS[booking.status]] += 1
+    paid_before = old_status in PAID_STATUSES
+    paid_now = booking.status in PAID_STATUSES
+    if paid_now != paid_before:
+        amounts['revenue'] += _amount(booking) if paid_now else -_amount(booking)
+    _increment(booking.seller_id, booking.timestamp.date(), **amounts)
+
+
+
+def record_review(review):
+    if review.timestamp is None:
+        review.timestamp = datetime.utcnow()
+    _increment(review.gig.seller_id, review.timestamp.date(), review_count=1, rating_sum=review.rating)
+
+
+
+def daily_stats(seller_id, days, today=None):
+    """The seller's rows for the last days days, oldest first, with empty days filled in."""
+    today = today or datetime.utcnow().date()
+    first = today - timedelta(days=days - 1)
+    rows = {row.day: row for row in SellerDailyStats.query
+            .filter(SellerDailyStats.seller_id == seller_id, SellerDailyStats.day >= first)
+            .order_by(SellerDailyStats.day)}
+    return [rows.get(first + timedelta(days=offset)) or
+            SellerDailyStats(seller_id=seller_id, day=first + timedelta(days=offset), **dict.fromkeys(COUNTERS, 0))
+            for offset in range(days)]
+
+
+
+def rebuild_seller_stats():
+    """Recompute every seller's counters from the booking and review tables.
+
+    Replaces the table in one transaction. Changes committed while it runs
+    can be counted twice or not at all, so run it when traffic is low.
+    Returns the number of rows written.
+    """
+    amount = func.coalesce(Booking.checkout_amount, func.round(Gig.price * 100))
+    booking_day = func.date(Booking.timestamp)
+    columns = [func.count().label('requested')]
+    columns += [func.sum(case((Booking.status == status, 1), else_=0)).label(name)
+                for status, name in STATUS_COLUMNS.items()]
+    columns.append(func.sum(case((Booking.status.in_(PAID_STATUSES), amount), else_=0)).label('revenue'))
+    booking_totals = db.session.query(Booking.seller_id, booking_day, *columns) \
+        .join(Gig, Gig.id == Booking.gig_id) \
+        .group_by(Booking.seller_id, booking_day)
+
+    review_day = func.date(Review.timestamp)
+    review_totals = db.session.query(Gig.seller_id, review_day, func.count(), func.sum(Review.rating)) \
+        .join(Gig, Gig.id == Review.gig_id) \
+        .group_by(Gig.seller_id, review_day)
+
+    rows = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    for seller_id, day, *totals in booking_totals:
+        rows[seller_id, _as_date(day)].update(zip(['requested', *STATUS_COLUMNS.values(), 'revenue'],
+                                                  (int(total or 0) for total in totals)))
+    for seller_id, day, count, rating_sum in review_totals:
+        rows[seller_id, _as_date(day)].update(review_count=count, rating_sum=int(rating_sum or 0))
+
+    db.session.query(SellerDailyStats).delete()
+    if rows:
+        db.session.execute(insert(SellerDailyStats.__table__),
+                           [dict(counters, seller_id=seller_id, day=day) for (seller_id, day), counters in rows.items()])
+    db.session.commit()
+    return len(rows)
+
+
+
+def _as_date(value):
+    # SQLite's date() returns text
+    return datetime.strptime(value, '%Y-%m-%d').date() if isinstance(value, str) else value
@@ -0,0 +1,34 @@
+import os
+import re
+import tempfile
+import uuid
+from app import app
+
+
+# Version stamps let every worker process on a host notice that cached data is
+# stale without asking the database. A bump atomically replaces a small file
+# holding a random token; readers compare it with the token they cached.
+
+
+
+def _path(name):
+    return os.path.join(app.config['CACHE_VERSION_DIR'], re.sub(r'[^\w.-]', '-', name))
+
+
+
+def get_version(name):
+    try:
+        with open(_path(name)) as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+
+def bump_version(name):
+    directory = app.config['CACHE_VERSION_DIR']
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write(uuid.uuid4().hex)
+    os.replace(tmp_path, _path(name))
@@ -0,0 +1,8 @@
+"""Reproducible load tests for gigagig.
+
+Run `python -m benchmarks run` from backend/. It seeds a scratch database,
+starts stub servers for the external APIs and the app, replays a weighted
+mix of real routes, and writes per-endpoint latency percentiles and
+throughput as JSON. `python -m benchmarks compare old.json new.json` diffs
+two result files.
+"""
@@ -0,0 +1,351 @@
+import argparse
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import requests
+import benchmarks
+from benchmarks.report import environment, default_output_path, write_results, load_results, compare
+from benchmarks.stubs import start_stubs, stub_urls
+
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+
+def _wait_until_up(url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f'{url} exited with code {process.returncode}')
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f'{url} did not come up within {timeout}s')
+
+
+
+def _spawn(args, env):
+    return subprocess.Popen([sys.executable, '-m', 'benchmarks', *args], cwd=BACKEND_DIR, env=env)
+
+
+
+def _scratch_env(scratch, stub_base, **extra):
+    """Environment for app processes using a scratch database and the stubs."""
+    env = dict(os.environ, **stub_urls(stub_base))
+    env.update({
+        'DATABASE_URL': f'sqlite:///{os.path.join(scratch, "benchmark.db")}',
+        'CACHE_VERSION_DIR': os.path.join(scratch, 'cache_versions'),
+        'SECRET_KEY': 'benchmark',
+        'GOOGLE_MAPS_API_KEY': 'benchmark',
+        'MAILGUN_API_KEY': 'key-benchmark',
+        'MAILGUN_DOMAIN': 'benchmark.example.com',
+        'STRIPE_SECRET_KEY': 'sk_test_benchmark',
+    }, **extra)
+    return env
+
+
+
+def _seed_scratch(args, env, manifest_path):
+    seed_args = ['seed', '--manifest', manifest_path, '--users', str(args.users), '--gigs', str(args.gigs),
+                 '--bookings', str(args.bookings), '--messages', str(args.messages), '--seed', str(args.seed)]
+    subprocess.run([sys.executable, '-m', 'benchmarks', *seed_args], cwd=BACKEND_DIR, env=env, check=True)
+
+
+
+def _serve(env, processes):
+    port = _free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    processes.append(_spawn(['serve', '--port', str(port)], env))
+    _wait_until_up(f'{base_url}/', processes[-1])
+    return base_url
+
+
+
+def _stop(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait()
+
+
+
+def _print_stats(name, stats):
+    latency = stats['latency_ms']
+    print(f'{name:<24} {stats["requests"]:>7} req {stats["errors"]:>5} err {stats["throughput"]:>9} req/s  '
+          f'p50 {latency.get("p50")} p95 {latency.get("p95")} p99 {latency.get("p99")} ms')
+
+
+
+def cmd_seed(args):
+    # The app reads its configuration from the environment on import
+    from flask_migrate import upgrade
+    from app import app
+    from app.models import User
+    from benchmarks.seed import seed, save_manifest
+
+    with app.app_context():
+        upgrade(directory=os.path.join(BACKEND_DIR, 'migrations'))
+        if User.query.first() is not None:
+            sys.exit('Refusing to seed a database that already has users.')
+        started = time.monotonic()
+        manifest = seed(args.users, args.gigs, args.bookings, args.messages, args.seed)
+    save_manifest(manifest, args.manifest)
+    print(f'Seeded {app.config["SQLALCHEMY_DATABASE_URI"]} in {time.monotonic() - started:.1f}s')
+
+
+
+def cmd_stubs(args):
+    server = start_stubs(args.host, args.port, args.latency / 1000, args.webhook_url, args.webhook_secret)
+    print(f'Stub APIs on http://{args.host}:{server.server_address[1]}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+
+def cmd_serve(args):
+    from werkzeug.serving import make_server
+    from app import app
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    make_server(args.host, args.port, app, threaded=True).serve_forever()
+
+
+
+def cmd_run(args):
+    from benchmarks.driver import drive
+    from benchmarks.seed import load_manifest
+
+    meta = environment()
+    processes = []
+    scratch = tempfile.mkdtemp(prefix='gigagig-bench-')
+    try:
+        base_url = args.url
+        if base_url is None:
+            stub_port = _free_port()
+            stub_base = f'http://127.0.0.1:{stub_port}'
+            env = _scratch_env(scratch, stub_base)
+            processes.append(_spawn(['stubs', '--port', str(stub_port), '--latency', str(args.stub_latency)], env))
+            _wait_until_up(f'{stub_base}/', processes[-1])
+
+            manifest_path = os.path.join(scratch, 'manifest.json')
+            _seed_scratch(args, env, manifest_path)
+            base_url = _serve(env, processes)
+        else:
+            if args.manifest is None:
+                sys.exit('--url needs the --manifest written by `python -m benchmarks seed`.')
+            manifest_path = args.manifest
+
+        manifest = load_manifest(manifest_path)
+        print(f'Driving {base_url} with {args.concurrency} workers for {args.duration}s (+{args.warmup}s warm-up)')
+        endpoints, total = drive(base_url, manifest, args.duration, args.warmup, args.concurrency, args.seed, args.only)
+    finally:
+        _stop(processes)
+        if args.keep:
+            print(f'Scratch files kept in {scratch}')
+        else:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    results = {
+        'meta': dict(meta, parameters={key: value for key, value in vars(args).items() if key != 'func'}),
+        'data': {key: manifest[key] for key in ('seed', 'users', 'gigs', 'bookings', 'messages')},
+        'endpoints': endpoints,
+        'total': total,
+    }
+    output = args.output or default_output_path(meta)
+    write_results(results, output)
+
+    for name, stats in sorted(endpoints.items()) + [('total', total)]:
+        _print_stats(name, stats)
+    print(f'Results written to {output}')
+
+
+
+SQLITE_MODES = {'default': '0', 'production': '1'}
+
+
+
+def cmd_concurrency(args):
+    """Mixed read/write load on several server processes, once per SQLite mode."""
+    from benchmarks.driver import drive, ENDPOINTS, WRITE_ENDPOINTS
+    from benchmarks.seed import load_manifest
+
+    meta = environment()
+    stubs = start_stubs(latency=args.stub_latency / 1000)
+    stub_base = f'http://127.0.0.1:{stubs.server_address[1]}'
+    write_names = {endpoint.name for endpoint in WRITE_ENDPOINTS}
+    modes = {}
+    try:
+        for mode in args.modes:
+            # A fresh database per mode: WAL is a property of the database file
+            scratch = tempfile.mkdtemp(prefix='gigagig-concurrency-')
+            processes = []
+            try:
+                env = _scratch_env(scratch, stub_base, SQLITE_PRODUCTION_MODE=SQLITE_MODES[mode],
+                                   EMAIL_OUTBOX_IN_PROCESS='0')
+                manifest_path = os.path.join(scratch, 'manifest.json')
+                _seed_scratch(args, env, manifest_path)
+                base_urls = [_serve(env, processes) for _ in range(args.processes)]
+                print(f'{mode}: {args.processes} processes, {args.concurrency} workers for {args.duration}s')
+                endpoints, total = drive(base_urls, load_manifest(manifest_path), args.duration, args.warmup,
+                                         args.concurrency, args.seed, endpoints=ENDPOINTS + WRITE_ENDPOINTS)
+            finally:
+                _stop(processes)
+                shutil.rmtree(scratch, ignore_errors=True)
+            writes = [stats for name, stats in endpoints.items() if name in write_names]
+            modes[mode] = {
+                'endpoints': endpoints,
+                'total': total,
+                'write_throughput': round(sum(stats['throughput'] for stats in writes), 2),
+                'write_errors': sum(stats['errors'] for stats in writes),
+            }
+    finally:
+        stubs.shutdown()
+
+    results = {
+        'meta': dict(meta, parameters={key: value for key, value in vars(args).items() if key != 'func'}),
+        'modes': modes,
+    }
+    output = args.output or default_output_path(meta, 'concurrency')
+    write_results(results, output)
+
+    for mode, result in modes.items():
+        print(f'{mode}: writes {result["write_throughput"]} req/s, {result["write_errors"]} failed')
+        for name in sorted(write_names):
+            _print_stats(f'  {name}', result['endpoints'].get(name) or {'requests': 0, 'errors': 0,
+                                                                        'throughput': 0, 'latency_ms': {}})
+        _print_stats('  total', result['total'])
+    print(f'Results written to {output}')
+
+
+
+def cmd_plans(args):
+    # Runs in this process, so configure the app before it is imported
+    scratch = tempfile.mkdtemp(prefix='gigagig-plans-')
+    stubs = start_stubs()
+    os.environ.update(stub_urls(f'http://127.0.0.1:{stubs.server_address[1]}'))
+    os.environ.update({
+        'DATABASE_URL': f'sqlite:///{os.path.join(scratch, "plans.db")}',
+        'CACHE_VERSION_DIR': os.path.join(scratch, 'cache_versions'),
+        'EMAIL_OUTBOX_IN_PROCESS': '0',
+    })
+    from flask_migrate import upgrade
+    from app import app, db
+    from app.presence import flush
+    from benchmarks.plans import check_plans
+    from benchmarks.seed import seed
+
+    try:
+        with app.app_context():
+            upgrade(directory=os.path.join(BACKEND_DIR, 'migrations'))
+            manifest = seed(args.users, args.gigs, args.bookings, args.messages, args.seed)
+        problems = check_plans(app, db, manifest, sys.stdout)
+        with app.app_context():
+            # Write buffered last_seen updates while the database still exists
+            flush()
+    finally:
+        stubs.shutdown()
+        shutil.rmtree(scratch, ignore_errors=True)
+    if problems:
+        sys.exit(f'{problems} query plan problem(s).')
+    print('All query plans use indexes.')
+
+
+
+def cmd_compare(args):
+    regressions = compare(load_results(args.old), load_results(args.new), args.threshold)
+    if regressions:
+        print(f'Regressed by more than {args.threshold}%: {", ".join(regressions)}')
+        sys.exit(1)
+
+
+
+def _add_data_arguments(parser):
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--gigs', type=int, default=2000)
+    parser.add_argument('--bookings', type=int, default=3000)
+    parser.add_argument('--messages', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the data and the request mix')
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=benchmarks.__doc__)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='seed a scratch database, start the app and stubs, and load test it')
+    _add_data_arguments(run)
+    run.add_argument('--duration', type=float, default=30, help='seconds of measured load')
+    run.add_argument('--warmup', type=float, default=5, help='seconds of unmeasured load first')
+    run.add_argument('--concurrency', type=int, default=8)
+    run.add_argument('--stub-latency', type=float, default=20, help='milliseconds each stub API call takes')
+    run.add_argument('--only', nargs='+', metavar='ENDPOINT', help='restrict the mix to these endpoints')
+    run.add_argument('--url', help='drive an already running server instead (seeded with `seed`)')
+    run.add_argument('--manifest', help='manifest from `seed`, required with --url')
+    run.add_argument('--output', help='results file (default: benchmarks/results/<commit>-<time>.json)')
+    run.add_argument('--keep', action='store_true', help='keep the scratch database')
+    run.set_defaults(func=cmd_run)
+
+    concurrency = commands.add_parser('concurrency',
+                                      help='compare default and production SQLite modes under mixed reads and writes')
+    _add_data_arguments(concurrency)
+    concurrency.add_argument('--modes', nargs='+', choices=sorted(SQLITE_MODES), default=['default', 'production'])
+    concurrency.add_argument('--processes', type=int, default=4, help='server processes sharing the database')
+    concurrency.add_argument('--concurrency', type=int, default=16)
+    concurrency.add_argument('--duration', type=float, default=20, help='seconds of measured load per mode')
+    concurrency.add_argument('--warmup', type=float, default=3, help='seconds of unmeasured load first')
+    concurrency.add_argument('--stub-latency', type=float, default=20, help='milliseconds each stub API call takes')
+    concurrency.add_argument('--output', help='results file (default: benchmarks/results/<commit>-<time>-concurrency.json)')
+    concurrency.set_defaults(func=cmd_concurrency)
+
+    seed = commands.add_parser('seed', help='migrate and seed the database in DATABASE_URL')
+    _add_data_arguments(seed)
+    seed.add_argument('--manifest', required=True, help='where to write the manifest for the driver')
+    seed.set_defaults(func=cmd_seed)
+
+    stubs = commands.add_parser('stubs', help='serve stub geocoding, Mailgun and Stripe APIs')
+    stubs.add_argument('--host', default='127.0.0.1')
+    stubs.add_argument('--port', type=int, default=8765)
+    stubs.add_argument('--latency', type=float, default=20, help='milliseconds per call')
+    stubs.add_argument('--webhook-url', help='where paid checkout sessions are reported, e.g. http://127.0.0.1:5000/stripe/webhook')
+    stubs.add_argument('--webhook-secret', default='whsec_benchmark', help='secret the webhook events are signed with')
+    stubs.set_defaults(func=cmd_stubs)
+
+    serve = commands.add_parser('serve', help='serve the app with a threaded WSGI server')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=5000)
+    serve.set_defaults(func=cmd_serve)
+
+    plans = commands.add_parser('plans', help='fail if a hot route runs a query that scans a whole table')
+    _add_data_arguments(plans)
+    plans.set_defaults(func=cmd_plans, users=20, gigs=300, bookings=400, messages=500)
+
+    diff = commands.add_parser('compare', help='diff two results files')
+    diff.add_argument('old')
+    diff.add_argument('new')
+    diff.add_argument('--threshold', type=float, default=10, help='percent change that counts as a regression')
+    diff.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+
+if __name__ == '__main__':
+    main()
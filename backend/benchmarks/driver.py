@@ -0,0 +1,172 @@
+import random
+import re
+import threading
+import time
+from collections import namedtuple
+import requests
+from benchmarks.report import summarize
+
+
+CSRF_RE = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+# request(rng, manifest, username) returns (method, path, requests kwargs).
+# login endpoints run on a session signed in as username, and form posts
+# (kwargs with 'data') get that session's CSRF token added.
+Endpoint = namedtuple('Endpoint', ['name', 'weight', 'login', 'expect', 'request'])
+
+
+
+def _gig(rng, manifest):
+    return rng.randint(1, manifest['gigs'])
+
+
+
+def _user(rng, manifest):
+    return f'user{rng.randint(1, manifest["users"])}'
+
+
+
+def _checkout(rng, manifest, username):
+    booking_id = rng.choice(manifest['accepted_bookings'][username])
+    return 'POST', f'/create-checkout-session/{booking_id}', {}
+
+
+
+def _batch(rng, manifest, username):
+    paths = [f'/gigs/{_gig(rng, manifest)}?fields=id,title,price,seller' for _ in range(3)]
+    return 'POST', '/api/v1/batch', {'json': {'requests': paths + ['/categories']}}
+
+
+
+def _send_message(rng, manifest, username):
+    data = {'message': ' '.join(rng.choice(manifest['words']) for _ in range(rng.randint(3, 30)))}
+    return 'POST', f'/send_message/{_user(rng, manifest)}', {'data': data}
+
+
+
+def _book_gig(rng, manifest, username):
+    data = {'booking_date': f'2030-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T{rng.randint(8, 20):02d}:00',
+            'duration': rng.choice([30, 60, 120])}
+    return 'POST', f'/book/{_gig(rng, manifest)}', {'data': data}
+
+
+
+ENDPOINTS = [
+    Endpoint('index', 5, False, (200,), lambda rng, m, u: ('GET', '/', {})),
+    Endpoint('gig_detail', 20, False, (200,), lambda rng, m, u: ('GET', f'/gig/{_gig(rng, m)}', {})),
+    Endpoint('search_keyword', 10, False, (200,),
+             lambda rng, m, u: ('GET', '/search_results', {'params': {'keyword': rng.choice(m['words'])}})),
+    Endpoint('search_nearby', 10, False, (200,),
+             lambda rng, m, u: ('GET', '/search_results', {'params': {'location': rng.choice(m['cities']), 'radius': 25}})),
+    Endpoint('search_category', 5, False, (200,),
+             lambda rng, m, u: ('GET', '/search_results', {'params': {'category_id': rng.randint(1, m['categories'])}})),
+    Endpoint('api_gigs', 10, False, (200,),
+             lambda rng, m, u: ('GET', '/api/v1/gigs', {'params': {'fields': 'id,title,price,category'}})),
+    Endpoint('api_gig', 10, False, (200,), lambda rng, m, u: ('GET', f'/api/v1/gigs/{_gig(rng, m)}', {})),
+    Endpoint('api_batch', 5, False, (200,), _batch),
+    Endpoint('user_profile', 5, True, (200,), lambda rng, m, u: ('GET', f'/user/{_user(rng, m)}', {})),
+    Endpoint('messages', 5, True, (200,), lambda rng, m, u: ('GET', '/messages', {})),
+    Endpoint('my_bookings', 5, True, (200,), lambda rng, m, u: ('GET', '/my_bookings', {})),
+    Endpoint('bookings_for_my_gigs', 5, True, (200,), lambda rng, m, u: ('GET', '/bookings_for_my_gigs', {})),
+    Endpoint('checkout', 2, True, (303,), _checkout),
+]
+
+# Added to the mix by the concurrency benchmark
+WRITE_ENDPOINTS = [
+    Endpoint('send_message', 20, True, (302,), _send_message),
+    # 409 when the seller is already booked at that time
+    Endpoint('book_gig', 10, True, (302, 409), _book_gig),
+]
+
+
+
+def login(session, base_url, username, password):
+    response = session.get(f'{base_url}/login')
+    match = CSRF_RE.search(response.text)
+    data = {'username': username, 'password': password, 'csrf_token': match.group(1) if match else ''}
+    response = session.post(f'{base_url}/login', data=data, allow_redirects=False)
+    if response.status_code != 302:
+        raise RuntimeError(f'Could not log in as {username} (HTTP {response.status_code})')
+    # Valid for every form this session posts
+    return data['csrf_token']
+
+
+
+class Recorder(object):
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, elapsed, ok):
+        with self._lock:
+            self.latencies.setdefault(name, [])
+            self.errors.setdefault(name, 0)
+            if ok:
+                self.latencies[name].append(elapsed)
+            else:
+                self.errors[name] += 1
+
+
+
+def _worker(index, base_url, manifest, endpoints, seed, start_at, stop_at, recorder):
+    rng = random.Random(f'{seed}-{index}')
+    anonymous = requests.Session()
+    signed_in = requests.Session()
+    buyers = sorted(manifest['accepted_bookings'])
+    username = buyers[index % len(buyers)]
+    csrf_token = login(signed_in, base_url, username, manifest['password'])
+
+    weights = [endpoint.weight for endpoint in endpoints]
+    while True:
+        now = time.monotonic()
+        if now >= stop_at:
+            break
+        endpoint = rng.choices(endpoints, weights)[0]
+        method, path, kwargs = endpoint.request(rng, manifest, username)
+        session = signed_in if endpoint.login else anonymous
+        if 'data' in kwargs:
+            kwargs['data'] = dict(kwargs['data'], csrf_token=csrf_token)
+        started = time.perf_counter()
+        try:
+            response = session.request(method, base_url + path, allow_redirects=False, timeout=30, **kwargs)
+            ok = response.status_code in endpoint.expect
+        except requests.exceptions.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - started
+        # Warm-up requests fill caches and connection pools but aren't counted
+        if now >= start_at:
+            recorder.record(endpoint.name, elapsed, ok)
+
+
+
+def drive(base_url, manifest, duration=30.0, warmup=5.0, concurrency=8, seed=0, only=None, endpoints=None):
+    """Replay the weighted endpoint mix and return per-endpoint stats.
+
+    base_url may be a list, to spread the workers over several servers.
+    """
+    base_urls = [base_url] if isinstance(base_url, str) else base_url
+    endpoints = [endpoint for endpoint in endpoints or ENDPOINTS if not only or endpoint.name in only]
+    if not manifest['accepted_bookings']:
+        endpoints = [endpoint for endpoint in endpoints if endpoint.name != 'checkout']
+        manifest = dict(manifest, accepted_bookings={'user1': []})
+
+    recorder = Recorder()
+    start_at = time.monotonic() + warmup
+    stop_at = start_at + duration
+    threads = [
+        threading.Thread(target=_worker,
+                         args=(i, base_urls[i % len(base_urls)], manifest, endpoints, seed, start_at, stop_at, recorder),
+                         name=f'benchmark-worker-{i}', daemon=True)
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    results = {name: summarize(recorder.latencies[name], recorder.errors[name], duration)
+               for name in sorted(recorder.latencies)}
+    all_latencies = [latency for latencies in recorder.latencies.values() for latency in latencies]
+    total = summarize(all_latencies, sum(recorder.errors.values()), duration)
+    return results, total
@@ -0,0 +1,133 @@
+import re
+from collections import namedtuple
+from sqlalchemy import event
+
+
+# Small lookup tables that are fine to read in full
+SMALL_TABLES = ('category', 'alembic_version')
+
+SCAN_RE = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?(?: USING (?:COVERING )?INDEX (\w+))?$')
+SORT = 'USE TEMP B-TREE FOR ORDER BY'
+# Subqueries SQLite evaluates first; scanning their output isn't a table scan
+SUBQUERY_RE = re.compile(r'^(?:CO-ROUTINE|MATERIALIZE) (\w+)$')
+
+# path may use {gig}, {username}, {partner} and {booking}. allow_sort marks
+# queries whose ordering can't come from an index (relevance rank, joins),
+# where sorting the matched rows is expected.
+# allow_index_scan marks unfiltered listings, which may walk a whole index in
+# order since they stop at LIMIT.
+Route = namedtuple('Route', ['path', 'login', 'allow_sort', 'allow_index_scan'], defaults=[False, False, False])
+
+ROUTES = [
+    Route('/gig/{gig}'),
+    Route('/gig/{gig}/availability?start=2024-02-15&days=7', login=True),
+    Route('/search_results', allow_index_scan=True),
+    Route('/search_results?category_id=1'),
+    Route('/search_results?keyword=guitar', allow_sort=True),
+    Route('/search_results?location=New York, NY&radius=25', allow_sort=True),
+    Route('/api/v1/gigs?fields=id,title,seller', allow_index_scan=True),
+    Route('/api/v1/gigs?category_id=2'),
+    Route('/api/v1/gigs/{gig}/reviews'),
+    Route('/user/{username}', login=True),
+    Route('/dashboard', login=True),
+    Route('/my_gigs', login=True),
+    Route('/messages', login=True),
+    Route('/messages/{partner}', login=True),
+    Route('/my_bookings', login=True),
+    Route('/bookings_for_my_gigs', login=True),
+    Route('/booking/{booking}', login=True),
+    Route('/api/v1/bookings', login=True),
+    Route('/api/v1/bookings?role=seller', login=True),
+    Route('/api/v1/messages', login=True),
+]
+
+
+
+def plan_problems(detail_lines, route):
+    problems = []
+    subqueries = {match.group(1) for match in map(SUBQUERY_RE.match, detail_lines) if match}
+    for detail in detail_lines:
+        match = SCAN_RE.match(detail)
+        if match and match.group(1) not in subqueries and re.sub(r'_\d+$', '', match.group(1)) not in SMALL_TABLES:
+            if match.group(2) is None:
+                problems.append(f'full table scan: {detail}')
+            elif not route.allow_index_scan:
+                problems.append(f'reads a whole index and filters afterwards: {detail}')
+        elif detail == SORT and not route.allow_sort:
+            problems.append('sorts in a temp b-tree instead of reading an index in order')
+    return problems
+
+
+
+def check_plans(app, db, manifest, out):
+    """Request every route in ROUTES and EXPLAIN each SELECT it ran.
+
+    Paginated API routes are requested again with their next cursor so the
+    keyset conditions are checked too. Returns the number of problems.
+    """
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            statements.append((statement, parameters))
+
+    username = sorted(manifest['accepted_bookings'])[0]
+    values = {
+        'username': username,
+        'booking': manifest['accepted_bookings'][username][0],
+        'gig': 1,
+    }
+
+    problems = 0
+    with app.app_context():
+        user_id = db.session.execute(db.text('SELECT id FROM user WHERE username = :u'), {'u': username}).scalar()
+        values['partner'] = db.session.execute(db.text(
+            'SELECT user.username FROM conversation JOIN user ON user.id = '
+            'CASE WHEN conversation.user_a_id = :id THEN conversation.user_b_id ELSE conversation.user_a_id END '
+            'WHERE conversation.user_a_id = :id OR conversation.user_b_id = :id '
+            'ORDER BY conversation.last_message_at DESC LIMIT 1'), {'id': user_id}).scalar()
+        values['gig'] = db.session.execute(db.text(
+            'SELECT gig_id FROM review GROUP BY gig_id ORDER BY COUNT(*) DESC LIMIT 1')).scalar() or 1
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        for route in ROUTES:
+            client = app.test_client()
+            if route.login:
+                with client.session_transaction() as session:
+                    session['_user_id'] = str(user_id)
+                    session['_fresh'] = True
+            paths = [route.path.format(**values)]
+            while paths:
+                path = paths.pop()
+                statements.clear()
+                response = client.get(path)
+                captured = list(statements)
+                if response.status_code != 200:
+                    out.write(f'FAIL {path}: HTTP {response.status_code}\n')
+                    problems += 1
+                    continue
+                if path.startswith('/api/') and '&cursor=' not in path and '?cursor=' not in path:
+                    next_cursor = (response.get_json() or {}).get('next_cursor')
+                    if next_cursor:
+                        paths.append(path + ('&' if '?' in path else '?') + f'cursor={next_cursor}')
+
+                route_problems = []
+                with engine.connect() as connection:
+                    for statement, parameters in captured:
+                        rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).fetchall()
+                        details = [row[-1] for row in rows]
+                        for problem in plan_problems(details, route):
+                            route_problems.append((problem, statement, details))
+                if route_problems:
+                    problems += len(route_problems)
+                    out.write(f'FAIL {path}\n')
+                    for problem, statement, details in route_problems:
+                        out.write(f'  {problem}\n')
+                        out.write('    ' + ' '.join(statement.split()) + '\n')
+                        out.write(''.join(f'      {detail}\n' for detail in details))
+                else:
+                    out.write(f'ok   {path} ({len(captured)} queries)\n')
+    finally:
+        event.remove(engine, 'before_cursor_execute', capture)
+    return problems
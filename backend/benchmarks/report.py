@@ -0,0 +1,119 @@
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+
+PERCENTILES = (50, 95, 99)
+
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+
+def summarize(latencies, errors, elapsed):
+    """Latency (in ms) and throughput stats for one endpoint."""
+    latencies = sorted(latencies)
+    count = len(latencies)
+    stats = {
+        'requests': count,
+        'errors': errors,
+        'throughput': round(count / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': {},
+    }
+    if count:
+        stats['latency_ms'] = {f'p{p}': round(percentile(latencies, p) * 1000, 2) for p in PERCENTILES}
+        stats['latency_ms']['mean'] = round(sum(latencies) / count * 1000, 2)
+        stats['latency_ms']['max'] = round(latencies[-1] * 1000, 2)
+    return stats
+
+
+
+def _git(*args):
+    try:
+        return subprocess.run(['git', *args], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+
+def environment():
+    """Where and on what code a run happened, so results can be told apart."""
+    status = _git('status', '--porcelain', '--untracked-files=no')
+    return {
+        'commit': _git('rev-parse', 'HEAD'),
+        'dirty': bool(status) if status is not None else None,
+        'started_at': datetime.now(timezone.utc).replace(microsecond=0).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+
+def default_output_path(meta, kind=None):
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+    commit = (meta['commit'] or 'unknown')[:10] + ('-dirty' if meta['dirty'] else '')
+    stamp = meta['started_at'].replace(':', '').replace('-', '')[:15]
+    return os.path.join(directory, f'{commit}-{stamp}{"-" + kind if kind else ""}.json')
+
+
+
+def write_results(results, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+
+def _change(old, new):
+    if not old or new is None:
+        return None
+    return (new - old) / old * 100
+
+
+
+def compare(old, new, threshold=10.0, out=sys.stdout):
+    """Print per-endpoint differences between two result files.
+
+    Returns the names of endpoints whose p95 latency rose, or whose
+    throughput fell, by more than threshold percent.
+    """
+    regressions = []
+    out.write(f'{"endpoint":<24}{"p50 ms":>26}{"p95 ms":>26}{"p99 ms":>26}{"req/s":>26}\n')
+    names = sorted(set(old['endpoints']) | set(new['endpoints']))
+    for name in names + ['total']:
+        before = old['total'] if name == 'total' else old['endpoints'].get(name)
+        after = new['total'] if name == 'total' else new['endpoints'].get(name)
+        if before is None or after is None:
+            out.write(f'{name:<24}{"only in " + ("new" if before is None else "old"):>26}\n')
+            continue
+        cells = []
+        for key in ('p50', 'p95', 'p99'):
+            a, b = before['latency_ms'].get(key), after['latency_ms'].get(key)
+            change = _change(a, b)
+            cells.append(f'{a} -> {b}' + (f' ({change:+.0f}%)' if change is not None else ''))
+        change = _change(before['throughput'], after['throughput'])
+        cells.append(f'{before["throughput"]} -> {after["throughput"]}' + (f' ({change:+.0f}%)' if change is not None else ''))
+        out.write(f'{name:<24}' + ''.join(f'{cell:>26}' for cell in cells) + '\n')
+
+        p95_change = _change(before['latency_ms'].get('p95'), after['latency_ms'].get('p95'))
+        if (p95_change is not None and p95_change > threshold) or (change is not None and change < -threshold):
+            regressions.append(name)
+    return regressions
@@ -0,0 +1,170 @@
+import json
+import random
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+from werkzeug.security import generate_password_hash
+
+
+PASSWORD = 'benchmark'
+BASE_TIME = datetime(2024, 1, 1)
+
+CITIES = {
+    'New York, NY': (40.7128, -74.0060),
+    'Los Angeles, CA': (34.0522, -118.2437),
+    'Chicago, IL': (41.8781, -87.6298),
+    'Houston, TX': (29.7604, -95.3698),
+    'Phoenix, AZ': (33.4484, -112.0740),
+    'Philadelphia, PA': (39.9526, -75.1652),
+    'San Antonio, TX': (29.4241, -98.4936),
+    'San Diego, CA': (32.7157, -117.1611),
+    'Dallas, TX': (32.7767, -96.7970),
+    'Seattle, WA': (47.6062, -122.3321),
+}
+
+CATEGORIES = ['Music', 'Photography', 'Tutoring', 'Catering', 'Cleaning', 'Moving',
+              'Design', 'Writing', 'Fitness', 'Gardening', 'Repairs', 'Pet Care']
+
+# Two words per title, so keyword searches match a few percent of gigs
+WORDS = ['guitar', 'piano', 'wedding', 'portrait', 'math', 'spanish', 'vegan', 'bbq', 'deep',
+         'office', 'studio', 'logo', 'resume', 'yoga', 'lawn', 'plumbing', 'dog', 'cat']
+
+STATUSES = ['Pending', 'Accepted', 'Declined', 'Confirmed', 'Completed']
+
+
+
+def _timestamp(rng):
+    return BASE_TIME + timedelta(seconds=rng.randrange(365 * 24 * 3600))
+
+
+
+def _insert(db, model, rows, chunk_size=1000):
+    for start in range(0, len(rows), chunk_size):
+        db.session.execute(insert(model), rows[start:start + chunk_size])
+
+
+
+def seed(users=200, gigs=2000, bookings=3000, messages=5000, seed=0):
+    """Fill an empty, migrated database with deterministic fake data.
+
+    The same arguments always produce the same rows, so results from
+    different commits are comparable. Returns a manifest describing what
+    the load driver can ask for.
+    """
+    # Imported here: the app reads DATABASE_URL on import, and the stubs and
+    # driver use this module without configuring the app at all
+    from app import db
+    from app.models import User, Category, Gig, Booking, Review, Message, Conversation
+    from app.seller_stats import rebuild_seller_stats
+
+    rng = random.Random(seed)
+    password_hash = generate_password_hash(PASSWORD)
+
+    user_rows = [{
+        'id': i, 'username': f'user{i}', 'email': f'user{i}@example.com',
+        'password_hash': password_hash, 'about_me': f'Benchmark user {i}',
+        'last_seen': _timestamp(rng), 'member_since': _timestamp(rng),
+    } for i in range(1, users + 1)]
+
+    category_rows = [{'id': i, 'name': name} for i, name in enumerate(CATEGORIES, 1)]
+
+    cities = list(CITIES)
+    gig_rows = []
+    for i in range(1, gigs + 1):
+        city = rng.choice(cities)
+        latitude, longitude = CITIES[city]
+        gig_rows.append({
+            'id': i, 'seller_id': rng.randint(1, users), 'category_id': rng.randint(1, len(CATEGORIES)),
+            'title': f'{rng.choice(WORDS).title()} {rng.choice(WORDS)} service {i}',
+            'description': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 80))),
+            'price': round(rng.uniform(10, 500), 2), 'location': city,
+            'travel_radius': rng.choice([5, 10, 25, 50]), 'timestamp': _timestamp(rng),
+            'latitude': latitude + rng.uniform(-0.3, 0.3), 'longitude': longitude + rng.uniform(-0.3, 0.3),
+            'rating_count': 0, 'rating_sum': 0,
+        })
+
+    booking_rows = []
+    review_rows = []
+    for i in range(1, bookings + 1):
+        gig = rng.choice(gig_rows)
+        buyer_id = rng.randint(1, users)
+        if buyer_id == gig['seller_id']:
+            buyer_id = buyer_id % users + 1
+        status = rng.choice(STATUSES)
+        booking_date = _timestamp(rng) + timedelta(days=30)
+        duration = rng.choice([30, 60, 120])
+        booking_rows.append({
+            'id': i, 'gig_id': gig['id'], 'buyer_id': buyer_id, 'seller_id': gig['seller_id'], 'status': status,
+            'booking_date': booking_date, 'duration': duration, 'end_date': booking_date + timedelta(minutes=duration),
+            'timestamp': _timestamp(rng),
+        })
+        if status == 'Completed':
+            rating = rng.randint(1, 5)
+            gig['rating_count'] += 1
+            gig['rating_sum'] += rating
+            review_rows.append({
+                'id': len(review_rows) + 1, 'gig_id': gig['id'], 'booking_id': i, 'user_id': buyer_id,
+                'rating': rating, 'comment': ' '.join(rng.choice(WORDS) for _ in range(12)),
+                'timestamp': _timestamp(rng),
+            })
+
+    message_rows = []
+    conversations = {}
+    for i in range(1, messages + 1):
+        sender_id, recipient_id = rng.sample(range(1, users + 1), 2)
+        pair = Conversation.pair(sender_id, recipient_id)
+        conversation = conversations.get(pair)
+        if conversation is None:
+            conversation = conversations[pair] = {
+                'id': len(conversations) + 1, 'user_a_id': pair[0], 'user_b_id': pair[1],
+                'last_message_at': None, 'unread_a': 0, 'unread_b': 0,
+            }
+        message = {
+            'id': i, 'sender_id': sender_id, 'recipient_id': recipient_id, 'conversation_id': conversation['id'],
+            'body': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(3, 30))), 'timestamp': _timestamp(rng),
+        }
+        message_rows.append(message)
+        if conversation['last_message_at'] is None or message['timestamp'] > conversation['last_message_at']:
+            conversation.update(last_message_body=message['body'], last_sender_id=sender_id,
+                                last_message_at=message['timestamp'])
+        if rng.random() < 0.3:
+            conversation['unread_a' if recipient_id == pair[0] else 'unread_b'] += 1
+    conversation_rows = list(conversations.values())
+
+    # Core inserts: the ORM unit of work would dominate seeding time
+    for model, rows in [(User, user_rows), (Category, category_rows), (Gig, gig_rows),
+                        (Booking, booking_rows), (Review, review_rows), (Conversation, conversation_rows),
+                        (Message, message_rows)]:
+        _insert(db, model, rows)
+    db.session.commit()
+    rebuild_seller_stats()
+
+    accepted = {}
+    for row in booking_rows:
+        if row['status'] == 'Accepted':
+            accepted.setdefault(f'user{row["buyer_id"]}', []).append(row['id'])
+    return {
+        'seed': seed,
+        'users': users,
+        'gigs': gigs,
+        'bookings': bookings,
+        'messages': messages,
+        'conversations': len(conversation_rows),
+        'password': PASSWORD,
+        'categories': len(CATEGORIES),
+        'cities': cities,
+        'words': WORDS,
+        # Buyers with bookings that can be paid for, and those booking ids
+        'accepted_bookings': accepted,
+    }
+
+
+
+def save_manifest(manifest, path):
+    with open(path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+
+def load_manifest(path):
+    with open(path) as f:
+        return json.load(f)
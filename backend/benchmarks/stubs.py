@@ -0,0 +1,160 @@
+import hashlib
+import hmac
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from urllib.request import Request, urlopen
+from benchmarks.seed import CITIES
+
+
+# Keyed like the app's geocode cache, so "new york, ny" finds "New York, NY"
+_CITIES = {name.lower(): location for name, location in CITIES.items()}
+
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """Answers like Google geocoding, Mailgun and Stripe checkout would.
+
+    Every response is delayed by the server's `latency` seconds to stand in
+    for the network round trip to the real service. Opening a session's url
+    (/pay/<id>) pays for it: the stub sends a signed checkout.session.completed
+    event to the server's webhook_url, if set, and redirects to success_url.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body):
+        time.sleep(self.server.latency)
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path.startswith('/stripe/v1/checkout/sessions/'):
+            session = self.server.sessions.get(url.path.rsplit('/', 1)[1])
+            if session is None:
+                return self._send(404, {'error': {'message': 'No such checkout.session'}})
+            return self._send(200, session)
+        if url.path.startswith('/pay/'):
+            return self._pay(url.path.rsplit('/', 1)[1])
+        if url.path != '/geocode':
+            return self._send(404, {'error': 'not found'})
+        address = parse_qs(url.query).get('address', [''])[0].strip().lower()
+        location = _CITIES.get(address)
+        if location is None:
+            return self._send(200, {'status': 'ZERO_RESULTS', 'results': []})
+        latitude, longitude = location
+        return self._send(200, {'status': 'OK', 'results': [{'geometry': {'location': {'lat': latitude, 'lng': longitude}}}]})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+        path = urlsplit(self.path).path
+        if path.startswith('/mailgun/') and path.endswith('/messages'):
+            return self._send(200, {'id': f'<{uuid.uuid4().hex}@stub>', 'message': 'Queued. Thank you.'})
+        if path == '/stripe/v1/checkout/sessions':
+            return self._send(200, self._create_session(parse_qs(body), self.headers.get('Idempotency-Key')))
+        if path.startswith('/stripe/v1/checkout/sessions/') and path.endswith('/expire'):
+            return self._expire_session(path.split('/')[-2])
+        return self._send(404, {'error': {'message': 'not found'}})
+
+    def _create_session(self, form, idempotency_key):
+        server = self.server
+        with server.lock:
+            if idempotency_key in server.idempotency_keys:
+                return server.sessions[server.idempotency_keys[idempotency_key]]
+            session_id = f'cs_test_{uuid.uuid4().hex}'
+            session = server.sessions[session_id] = {
+                'id': session_id,
+                'object': 'checkout.session',
+                'mode': 'payment',
+                'status': 'open',
+                'payment_status': 'unpaid',
+                'client_reference_id': form.get('client_reference_id', [None])[0],
+                'metadata': {key[len('metadata['):-1]: values[0] for key, values in form.items()
+                             if key.startswith('metadata[')},
+                'success_url': form.get('success_url', [None])[0],
+                'expires_at': int(time.time()) + 24 * 3600,
+                'url': f'http://{server.server_address[0]}:{server.server_address[1]}/pay/{session_id}',
+            }
+            if idempotency_key:
+                server.idempotency_keys[idempotency_key] = session_id
+            server.sessions_created += 1
+            return session
+
+    def _expire_session(self, session_id):
+        with self.server.lock:
+            session = self.server.sessions.get(session_id)
+            if session is None:
+                return self._send(404, {'error': {'type': 'invalid_request_error', 'message': 'No such checkout.session'}})
+            if session['status'] != 'open':
+                return self._send(400, {'error': {'type': 'invalid_request_error',
+                                                  'message': f'Session is {session["status"]}, not open'}})
+            session['status'] = 'expired'
+        return self._send(200, session)
+
+    def _pay(self, session_id):
+        session = self.server.sessions.get(session_id)
+        if session is None:
+            return self._send(404, {'error': {'message': 'No such checkout.session'}})
+        session.update(status='complete', payment_status='paid')
+        if self.server.webhook_url:
+            send_webhook(self.server.webhook_url, self.server.webhook_secret, 'checkout.session.completed', session)
+        time.sleep(self.server.latency)
+        self.send_response(303)
+        self.send_header('Location', session['success_url'] or '/')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+
+def send_webhook(url, secret, event_type, obj):
+    """POST a Stripe-style event to url, signed the way Stripe signs them."""
+    payload = json.dumps({
+        'id': f'evt_{uuid.uuid4().hex}',
+        'object': 'event',
+        'type': event_type,
+        'created': int(time.time()),
+        'data': {'object': obj},
+    })
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    request = Request(url, data=payload.encode(), method='POST', headers={
+        'Content-Type': 'application/json',
+        'Stripe-Signature': f't={timestamp},v1={signature}',
+    })
+    with urlopen(request, timeout=10) as response:
+        return response.status
+
+
+
+def stub_urls(base_url):
+    """Environment variables that point the app at stubs served from base_url."""
+    return {
+        'GEOCODE_URL': f'{base_url}/geocode',
+        'MAILGUN_BASE_URL': f'{base_url}/mailgun',
+        'STRIPE_API_BASE': f'{base_url}/stripe',
+    }
+
+
+
+def start_stubs(host='127.0.0.1', port=0, latency=0.0, webhook_url=None, webhook_secret=None):
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.webhook_url = webhook_url
+    server.webhook_secret = webhook_secret
+    server.lock = threading.Lock()
+    server.sessions = {}
+    server.idempotency_keys = {}
+    server.sessions_created = 0
+    threading.Thread(target=server.serve_forever, name='benchmark-stubs', daemon=True).start()
+    return server
@@ -0,0 +1,71 @@
+"""Add full-text search index over gig title and description
+
+Revision ID: e5d20b7f9a41
+Revises: c18f4a6e2b97
+Create Date: 2026-10-18 11:27:09.664512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5d20b7f9a41'
+down_revision = 'c18f4a6e2b97'
+branch_labels = None
+depends_on = None
+
+
+# Written out here rather than imported from app.search, so this revision
+# keeps creating what it created when it was written.
+SQLITE_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS gig_fts USING fts5(
+        title, description, content='gig', content_rowid='id',
+        tokenize='porter unicode61')""",
+    """CREATE TRIGGER IF NOT EXISTS gig_fts_ai AFTER INSERT ON gig BEGIN
+        INSERT INTO gig_fts(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS gig_fts_ad AFTER DELETE ON gig BEGIN
+        INSERT INTO gig_fts(gig_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS gig_fts_au AFTER UPDATE OF title, description ON gig BEGIN
+        INSERT INTO gig_fts(gig_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO gig_fts(rowid, title, description)
+        VALUES (new.id, new.title, new.description);
+    END""",
+]
+
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS gig_fts_au',
+    'DROP TRIGGER IF EXISTS gig_fts_ad',
+    'DROP TRIGGER IF EXISTS gig_fts_ai',
+    'DROP TABLE IF EXISTS gig_fts',
+]
+
+POSTGRES_DDL = [
+    """CREATE INDEX IF NOT EXISTS ix_gig_fts ON gig
+        USING gin (to_tsvector('english'::regconfig, title || ' ' || description))""",
+]
+
+POSTGRES_DROP = [
+    'DROP INDEX IF EXISTS ix_gig_fts',
+]
+
+
+def _run(statements_by_dialect):
+    for statement in statements_by_dialect.get(op.get_bind().dialect.name, []):
+        op.execute(statement)
+
+
+def upgrade():
+    _run({'sqlite': SQLITE_DDL, 'postgresql': POSTGRES_DDL})
+    # Index the gigs that already exist
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute("INSERT INTO gig_fts(gig_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    _run({'sqlite': SQLITE_DROP, 'postgresql': POSTGRES_DROP})
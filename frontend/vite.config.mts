@@ -70,6 +70,10 @@ export default defineConfig({
   },
   server: {
     port: 3000,
+    proxy: {
+      // Same origin as the SPA, so the Flask session cookie is sent
+      '/api': 'http://127.0.0.1:5000',
+    },
   },
   css: {
     preprocessorOptions: {